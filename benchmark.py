@@ -0,0 +1,226 @@
+import importlib
+import json
+import resource
+import sys
+import tempfile
+import time
+from multiprocessing import get_context
+from os import path
+
+import metrics
+
+baseline_file = path.join(path.dirname(path.realpath(__file__)), "benchmark.json")
+
+# a fixed sample of pages that exercise the expensive paths of each entry point
+sample_pages = {
+    "opening": [1, 2],
+    "surah start": [604],
+    "dense": [552],
+    "indeterminate": [200],
+}
+
+repeat = 3
+time_tolerance = 0.25
+# stages that take a few milliseconds are too noisy to compare by ratio alone
+time_slack = 0.05
+memory_tolerance = 0.1
+# what a cold build.py imports, in the order it needs them
+startup_modules = [
+    "build",
+    "optimize",
+    "scour.scour",
+    "svgelements",
+    "line_split",
+    "svgpathtools",
+]
+
+
+def peak_rss():
+    # kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_optimize(page, directory):
+    import optimize
+
+    optimize.output_dir = directory
+    with open(path.join(path.dirname(optimize.svg_dir), "surah.json")) as fp:
+        surahs = json.load(fp)
+
+    return optimize.process_file(f"{page:03}.svg", surahs)["metrics"]["stages"]
+
+
+def run_line_split(page, directory):
+    import line_split
+
+    line_split.svg_dir = directory
+    return line_split.process_svg_file(page)["metrics"]["stages"]
+
+
+def run_positions(page, directory):
+    import positions
+
+    filepath = path.join(directory, f"{page:03}.svg")
+    page_metrics = metrics.new_metrics("positions", page)
+
+    with metrics.stage(page_metrics, "read"):
+        page_height, markers = positions.read_markers(filepath)
+    with metrics.stage(page_metrics, "sort"):
+        positions.sort_markers(markers, page, page_height)
+    return page_metrics["stages"]
+
+
+entry_points = {
+    "optimize": run_optimize,
+    "line_split": run_line_split,
+    "positions": run_positions,
+}
+
+
+def run_entry(entry, page, directory):
+    # the import is timed on its own as every fresh interpreter pays for it
+    start_time = time.perf_counter()
+    importlib.import_module(entry)
+    import_seconds = time.perf_counter() - start_time
+    stages = entry_points[entry](page, directory)
+    return {
+        "seconds": time.perf_counter() - start_time,
+        "stages": dict(stages, **{"import": import_seconds}),
+        "peak_rss_mb": peak_rss(),
+    }
+
+
+def run_imports():
+    # modules in the order the driver needs them, each timed without what the
+    # ones before it already imported
+    stages = {}
+    for module in startup_modules:
+        start_time = time.perf_counter()
+        importlib.import_module(module)
+        stages[module] = time.perf_counter() - start_time
+    return {
+        "seconds": sum(stages.values()),
+        "stages": stages,
+        "peak_rss_mb": peak_rss(),
+    }
+
+
+def measure_startup():
+    # a driver pool has to be started from this process, pool workers cannot
+    # start pools of their own
+    import build
+
+    runs = []
+    for _ in range(repeat):
+        with get_context("spawn").Pool(1) as p:
+            runs.append(p.apply(run_imports))
+
+        start_time = time.perf_counter()
+        with build.start_pool(build.default_stages, 1) as p:
+            p.apply(abs, (0,))
+        runs[-1]["stages"]["pool"] = time.perf_counter() - start_time
+        runs[-1]["seconds"] += runs[-1]["stages"]["pool"]
+
+    return best_run(runs)
+
+
+def best_run(runs):
+    best = min(runs, key=lambda x: x["seconds"])
+    return {
+        "seconds": round(best["seconds"], 3),
+        "stages": {x: round(y, 3) for x, y in best["stages"].items()},
+        "peak_rss_mb": round(max(x["peak_rss_mb"] for x in runs), 1),
+    }
+
+
+def measure(entry, page, directory):
+    # every run gets a fresh interpreter so peak memory belongs to that page
+    # alone, the fastest run is kept as the least noisy one
+    runs = []
+    for _ in range(repeat):
+        with get_context("spawn").Pool(1) as p:
+            runs.append(p.apply(run_entry, (entry, page, directory)))
+
+    return best_run(runs)
+
+
+def run_benchmarks():
+    result = measure_startup()
+    results = {"startup": {"cold": dict(result, kind="startup")}}
+    print(
+        f"startup: {result['seconds']:.3f} seconds "
+        f"({', '.join(f'{x} {y:.3f}' for x, y in result['stages'].items())})"
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        # entry points run in pipeline order, each one reads what the last wrote
+        for entry in entry_points:
+            results[entry] = {}
+            for kind, pages in sample_pages.items():
+                for page in pages:
+                    result = measure(entry, page, directory)
+                    results[entry][f"{page:03}"] = dict(result, kind=kind)
+                    print(
+                        f"{entry} {page:03} ({kind}): {result['seconds']:.3f} "
+                        f"seconds, {result['peak_rss_mb']} MB"
+                    )
+
+    return results
+
+
+def compare(results, baseline):
+    regressions = []
+    for entry, pages in results.items():
+        for page, result in pages.items():
+            expected = baseline.get(entry, {}).get(page)
+            if expected is None:
+                continue
+
+            timings = [("wall", result["seconds"], expected["seconds"])]
+            for stage, seconds in result["stages"].items():
+                if stage in expected["stages"]:
+                    timings.append((stage, seconds, expected["stages"][stage]))
+
+            for stage, seconds, expected_seconds in timings:
+                limit = expected_seconds * (1 + time_tolerance) + time_slack
+                if seconds > limit:
+                    regressions.append(
+                        f"{entry} {page} {stage}: {seconds:.3f} seconds, "
+                        f"baseline {expected_seconds:.3f}"
+                    )
+
+            limit = expected["peak_rss_mb"] * (1 + memory_tolerance)
+            if result["peak_rss_mb"] > limit:
+                regressions.append(
+                    f"{entry} {page} memory: {result['peak_rss_mb']} MB, "
+                    f"baseline {expected['peak_rss_mb']} MB"
+                )
+
+    return regressions
+
+
+def load_baseline():
+    if not path.exists(baseline_file):
+        return {}
+
+    with open(baseline_file) as fp:
+        return json.load(fp)
+
+
+def save_baseline(results):
+    with open(baseline_file, "w") as fp:
+        json.dump(results, fp, indent=4, sort_keys=True)
+
+
+if __name__ == "__main__":
+    results = run_benchmarks()
+
+    if "--save" in sys.argv:
+        save_baseline(results)
+        print(f"Saved baseline to {baseline_file}")
+    else:
+        regressions = compare(results, load_baseline())
+        for regression in regressions:
+            print(f"  regression in {regression}")
+        if len(regressions) > 0:
+            sys.exit(1)
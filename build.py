@@ -0,0 +1,119 @@
+import importlib
+import sys
+import time
+from multiprocessing import Pool
+
+# stages in pipeline order with the modules their pool workers import up front,
+# optimize also writes the positions and regions the later stages read
+stage_modules = {
+    "optimize": ["optimize", "scour.scour", "svgelements"],
+    "line_split": ["line_split", "svgpathtools"],
+    "compress": ["compress"],
+    "pack": [],
+    "validate": ["validate"],
+}
+default_stages = ["optimize", "line_split"]
+
+
+def init_worker(surahs, modules):
+    # workers import what their stages need once, while the parent is still
+    # hashing pages for the cache, and keep the read only surah table
+    for module in modules:
+        importlib.import_module(module)
+
+    import optimize
+
+    optimize.init_worker(surahs)
+
+
+def start_pool(stages, processes=None):
+    import optimize
+
+    modules = [x for stage in stages for x in stage_modules[stage]]
+    return Pool(
+        processes,
+        initializer=init_worker,
+        initargs=(optimize.load_surahs(), modules),
+    )
+
+
+def run_stage(stage, pool, pages, force, profile, check_lines=True):
+    # returns the pages that failed
+    if stage == "optimize":
+        import optimize
+
+        return sorted(optimize.optimize_svgs(force, profile, pool))
+    elif stage == "line_split":
+        import line_split
+
+        pages = pages or line_split.parse_pages("all")
+        results = line_split.process_svg_files(pages, profile, force, pool)
+        return sorted(x["page"] for x in results if "error" in x)
+    elif stage == "compress":
+        import compress
+
+        compress.compress_output(force=force, pool=pool)
+        return []
+    elif stage == "pack":
+        import pack
+
+        size = pack.pack_output()
+        print(f"Packed {size} bytes into {pack.archive_file}")
+        return []
+    elif stage == "validate":
+        import validate
+
+        violations = validate.validate_output(check_lines=check_lines, pool=pool)
+        validate.print_violations(violations)
+        return sorted({x[0] or 0 for x in violations})
+    else:
+        raise Exception(f"unknown stage {stage}")
+
+
+def build(stages=None, pages=None, force=False, profile=False):
+    # one pool serves every stage, so workers start and import only once
+    # the stages after one with failed pages would only build on missing files
+    stages = stages or default_stages
+    timings = {}
+    failed = []
+
+    start_time = time.perf_counter()
+    with start_pool(stages) as pool:
+        timings["startup"] = time.perf_counter() - start_time
+        for stage in stages:
+            stage_start = time.perf_counter()
+            # lines are only checked when they are built in the same run
+            failed = run_stage(
+                stage, pool, pages, force, profile, "line_split" in stages
+            )
+            timings[stage] = time.perf_counter() - stage_start
+            if len(failed) > 0:
+                print(f"Stopped after {stage}, {len(failed)} pages failed")
+                break
+
+    for stage, seconds in timings.items():
+        print(f"  {stage}: {seconds:.2f} seconds")
+    return timings, failed
+
+
+if __name__ == "__main__":
+    stages = [x for x in sys.argv[1:] if not x.startswith("--")]
+    pages = None
+    for argument in sys.argv[1:]:
+        if argument.startswith("--pages="):
+            import line_split
+
+            pages = line_split.parse_pages(argument.split("=")[1])
+
+    if any(x not in stage_modules for x in stages):
+        print(
+            "Usage: build.py [optimize] [line_split] [compress] [pack] [validate] "
+            "[--pages=FIRST-LAST] [--force] [--profile]"
+        )
+        sys.exit(1)
+
+    _, failed = build(
+        stages, pages, force="--force" in sys.argv, profile="--profile" in sys.argv
+    )
+    if len(failed) > 0:
+        sys.exit(1)
@@ -0,0 +1,139 @@
+import gzip
+import hashlib
+import io
+import json
+import re
+import sys
+from functools import partial
+from multiprocessing import Pool
+from os import path, remove, walk
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+output_dir = path.join(path.dirname(path.realpath(__file__)), "output")
+manifest_name = "compressed.json"
+# the files apps fetch: pages, their positions, lines and ayah rectangles, and
+# the corpus wide tables, paths relative to the output directory
+served_file = re.compile(
+    r"^(\d{3}\.(svg|json)|\d{3}/(\d{1,2}\.svg|ayahs\.json)"
+    r"|markers\.json|surah\.json|regions\.json)$"
+)
+hash_length = 12
+
+
+def served_files(directory):
+    found = []
+    for root, _, filenames in walk(directory):
+        for filename in filenames:
+            name = path.relpath(path.join(root, filename), directory)
+            name = name.replace(path.sep, "/")
+            if served_file.match(name):
+                found.append(name)
+    return sorted(found)
+
+
+def hashed_name(name, digest):
+    # immutable URL for a version of a file, 001.svg becomes 001.<hash>.svg
+    stem, extension = path.splitext(name)
+    return f"{stem}.{digest[:hash_length]}{extension}"
+
+
+def gzip_bytes(data):
+    # no name and a zero timestamp so the same input always gives the same file
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode="wb", compresslevel=9, mtime=0) as fp:
+        fp.write(data)
+    return out.getvalue()
+
+
+def encodings():
+    return ["gzip", "br"] if brotli is not None else ["gzip"]
+
+
+def compress_file(name, previous, directory):
+    # returns the manifest entry of a file, compressing it only if its hash
+    # differs from the previous entry or a compressed sibling is missing
+    filepath = path.join(directory, name)
+    with open(filepath, "rb") as fp:
+        data = fp.read()
+
+    digest = hashlib.sha256(data).hexdigest()
+    suffixes = {"gzip": ".gz", "br": ".br"}
+    if previous is not None and previous["hash"] == digest:
+        if all(
+            x in previous and path.exists(filepath + suffixes[x]) for x in encodings()
+        ):
+            return previous, False
+
+    entry = {"hash": digest, "size": len(data), "url": hashed_name(name, digest)}
+    for encoding in encodings():
+        if encoding == "gzip":
+            compressed = gzip_bytes(data)
+        else:
+            compressed = brotli.compress(data, quality=11)
+        with open(filepath + suffixes[encoding], "wb") as fp:
+            fp.write(compressed)
+        entry[encoding] = len(compressed)
+
+    return entry, True
+
+
+def compress_task(item, directory):
+    name, previous = item
+    return (name, *compress_file(name, previous, directory))
+
+
+def load_manifest(directory):
+    manifest_file = path.join(directory, manifest_name)
+    if not path.exists(manifest_file):
+        return {}
+
+    with open(manifest_file) as fp:
+        return json.load(fp)
+
+
+def compress_output(directory=output_dir, force=False, pool=None):
+    # writes .gz, and .br when brotli is installed, next to every served file
+    # and a manifest of hashes and sizes, returning how many were compressed
+    previous = {} if force else load_manifest(directory)
+    names = served_files(directory)
+    items = [(x, previous.get(x)) for x in names]
+    task = partial(compress_task, directory=directory)
+    chunksize = max(1, len(items) // 64)
+
+    if pool is None:
+        with Pool() as p:
+            results = list(p.imap_unordered(task, items, chunksize))
+    else:
+        results = list(pool.imap_unordered(task, items, chunksize))
+
+    manifest = {name: entry for name, entry, _ in results}
+    compressed = sum(1 for _, _, changed in results if changed)
+
+    # siblings of files that are no longer served
+    for name in set(previous) - set(manifest):
+        for suffix in [".gz", ".br"]:
+            if path.exists(path.join(directory, name + suffix)):
+                remove(path.join(directory, name + suffix))
+
+    with open(path.join(directory, manifest_name), "w") as fp:
+        json.dump({x: manifest[x] for x in sorted(manifest)}, fp, indent=4)
+
+    size = sum(x["size"] for x in manifest.values())
+    gzip_size = sum(x["gzip"] for x in manifest.values())
+    print(
+        f"Compressed {compressed} of {len(manifest)} files, {size} to {gzip_size} "
+        f"bytes with gzip ({1 - gzip_size / max(size, 1):.1%} saved)"
+    )
+    if brotli is not None:
+        br_size = sum(x["br"] for x in manifest.values())
+        print(f"  {br_size} bytes with brotli ({1 - br_size / max(size, 1):.1%} saved)")
+
+    return compressed
+
+
+if __name__ == "__main__":
+    compress_output(force="--force" in sys.argv)
@@ -0,0 +1,288 @@
+import hashlib
+import sys
+from multiprocessing import Pool
+from os import makedirs, path
+
+import numpy as np
+
+import minify
+import optimize
+import positions
+
+glyphs_dir = path.join(optimize.output_dir, "glyphs")
+sprite_file = "glyphs.svg"
+# largest distance in viewBox units a shape may move when it is replaced by an
+# earlier shape that looks the same
+dedup_tolerance = 0.02
+shared_groups = ["content", "ayah_markers"]
+point_counts = {"M": 1, "L": 1, "C": 3, "Q": 2, "Z": 0}
+sprite_template = (
+    '<?xml version="1.0" ?><svg xmlns="http://www.w3.org/2000/svg" version="1.1">'
+    "{symbols}</svg>\n"
+)
+symbol_template = '<symbol id="{id}" overflow="visible"><path d="{d}"/></symbol>'
+
+
+def split_shapes(segments):
+    # subpaths inside the bounds of the one before belong to the same shape,
+    # so counters stay with their letter and even-odd filling still works
+    subpaths = []
+    for command, points in segments:
+        if command == "M" or len(subpaths) == 0:
+            subpaths.append([])
+        subpaths[-1].append((command, points))
+
+    shapes = []
+    outer = None
+    for subpath in subpaths:
+        points = np.array([x for _, points in subpath for x in points])
+        bounds = (*points.min(axis=0), *points.max(axis=0))
+        if outer is not None and outer[0] <= bounds[0] and outer[1] <= bounds[1]:
+            if bounds[2] <= outer[2] and bounds[3] <= outer[3]:
+                shapes[-1].extend(subpath)
+                continue
+
+        shapes.append(subpath)
+        outer = bounds
+
+    return shapes
+
+
+def normalize_shape(shape, decimals):
+    # moves the shape's first point to the origin of the grid so copies of a
+    # glyph anywhere on any page end up with the same coordinates
+    step = 10**-decimals
+    grid = np.array(
+        [(round(x / step), round(y / step)) for _, points in shape for x, y in points]
+    )
+    return grid - grid[0], tuple(grid[0])
+
+
+def shape_path(commands, grid, decimals):
+    step = 10**-decimals
+    segments = []
+    i = 0
+    for command in commands:
+        count = point_counts[command]
+        segments.append(
+            (command, [(x * step, y * step) for x, y in grid[i : i + count]])
+        )
+        i += count
+    return minify.quantize_segments(segments, decimals)
+
+
+def shape_key(commands, grid, unit):
+    # shapes can only match if they have the same commands and about the same
+    # size, so only those are compared point by point
+    size = np.ptp(grid, axis=0) * unit
+    return hashlib.sha1(f"{commands} {np.round(size * 2)}".encode()).hexdigest()
+
+
+def page_paths(in_string, handle_path, defs=""):
+    # streams a page and hands every path in the content and marker groups to
+    # handle_path(writer, attributes, scale), which returns True if it wrote a
+    # group in the path's place, the rest is copied as it is
+    writer = optimize.XMLWriter()
+    frames = [{"matrix": optimize.identity, "shared": False, "replaced": False}]
+
+    def start(name, attributes):
+        attributes = optimize.pair_attributes(attributes)
+        if len(frames) == 1:
+            optimize.set_attribute(
+                attributes, "xmlns:xlink", "http://www.w3.org/1999/xlink"
+            )
+
+        parent = frames[-1]
+        transform = optimize.parse_transform(
+            optimize.get_attribute(attributes, "transform")
+        )
+        frame = {
+            "matrix": optimize.multiply(parent["matrix"], transform),
+            "shared": parent["shared"]
+            or optimize.get_attribute(attributes, "id") in shared_groups,
+            "replaced": False,
+        }
+        frames.append(frame)
+
+        if frame["shared"] and name == "path":
+            scale = minify.matrix_scale(frame["matrix"])
+            frame["replaced"] = handle_path(writer, attributes, scale)
+        if not frame["replaced"]:
+            writer.start(name, attributes)
+
+    def end(name):
+        frame = frames.pop()
+        if len(frames) == 1 and len(defs) > 0:
+            writer.flush()
+            writer.chunks.append(defs)
+        writer.end("g" if frame["replaced"] else name)
+
+    optimize.create_parser(start, end, writer.text, writer.comment).Parse(
+        in_string.encode("utf-8"), True
+    )
+
+    return writer.getvalue()
+
+
+def read_path(attributes, scale):
+    path_definition = optimize.get_attribute(attributes, "d")
+    decimals = minify.path_decimals(dedup_tolerance, scale)
+    shapes = split_shapes(minify.absolute_segments(path_definition))
+    return shapes, decimals, 10**-decimals * scale
+
+
+def page_shapes(filename):
+    # returns (key, grid, unit, commands, decimals) for each shape on the page
+    found = []
+
+    def handle_path(writer, attributes, scale):
+        shapes, decimals, unit = read_path(attributes, scale)
+        for shape in shapes:
+            grid, _ = normalize_shape(shape, decimals)
+            commands = "".join(x[0] for x in shape)
+            key = shape_key(commands, grid, unit)
+            found.append((key, grid, unit, commands, decimals))
+        return False
+
+    with open(path.join(optimize.output_dir, filename)) as fp:
+        page_paths(fp.read(), handle_path)
+
+    return found
+
+
+def find_symbols(pages):
+    # shapes are matched in page order so symbol ids are the same on every run
+    buckets = {}
+    symbols = []
+    references = {}
+    deviation = 0
+
+    for filename, shapes in pages:
+        references[filename] = []
+        for key, grid, unit, commands, decimals in shapes:
+            for symbol_id in buckets.get(key, []):
+                symbol_grid = symbols[symbol_id]["grid"]
+                if symbol_grid.shape != grid.shape:
+                    continue
+                distance = np.max(np.hypot(*(grid - symbol_grid).T)) * unit
+                if distance <= dedup_tolerance:
+                    deviation = max(deviation, distance)
+                    break
+            else:
+                symbol_id = len(symbols)
+                d = shape_path(commands, grid, decimals)
+                symbols.append({"grid": grid, "d": d, "count": 0})
+                buckets.setdefault(key, []).append(symbol_id)
+
+            symbols[symbol_id]["count"] += 1
+            references[filename].append(symbol_id)
+
+    return symbols, references, deviation
+
+
+def write_page(filename, references, symbols, self_contained):
+    # shapes used once stay inline, shared ones become <use> references with
+    # the offset of their first point, symbols maps the shared ids to paths
+    shape_index = 0
+    href = "#" if self_contained else f"{sprite_file}#"
+
+    def handle_path(writer, attributes, scale):
+        nonlocal shape_index
+        inline = []
+        uses = []
+        shapes, decimals, _ = read_path(attributes, scale)
+        for shape in shapes:
+            symbol_id = references[shape_index]
+            shape_index += 1
+            if symbol_id not in symbols:
+                inline.extend(shape)
+                continue
+
+            _, offset = normalize_shape(shape, decimals)
+            x, y = [minify.format_number(x, decimals) for x in offset]
+            uses.append([("xlink:href", f"{href}s{symbol_id}"), ("x", x), ("y", y)])
+
+        writer.start("g", [x for x in attributes if x[0] != "d"])
+        if len(inline) > 0:
+            writer.start("path", [("d", minify.quantize_segments(inline, decimals))])
+            writer.end("path")
+        for use in uses:
+            writer.start("use", use)
+            writer.end("use")
+        return True
+
+    defs = ""
+    if self_contained and len(symbols) > 0:
+        defs = "".join(
+            symbol_template.format(id=f"s{x}", d=symbols[x]) for x in sorted(symbols)
+        )
+        defs = f"<defs>{defs}</defs>"
+
+    with open(path.join(optimize.output_dir, filename)) as fp:
+        out_string = page_paths(fp.read(), handle_path, defs)
+
+    with open(path.join(glyphs_dir, filename), "w") as fp:
+        fp.write(out_string)
+
+    return len(out_string.encode())
+
+
+def dedup_pages(self_contained=False):
+    files = positions.page_files(optimize.output_dir)
+    makedirs(glyphs_dir, exist_ok=True)
+
+    with Pool() as p:
+        # pages come back in order, so only unique shapes are kept in memory
+        shapes = p.imap(page_shapes, files)
+        symbols, references, deviation = find_symbols(zip(files, shapes))
+
+    shared = {i for i, x in enumerate(symbols) if x["count"] > 1}
+    if not self_contained:
+        with open(path.join(glyphs_dir, sprite_file), "w") as fp:
+            fp.write(
+                sprite_template.format(
+                    symbols="".join(
+                        symbol_template.format(id=f"s{i}", d=symbols[i]["d"])
+                        for i in sorted(shared)
+                    )
+                )
+            )
+
+    with Pool() as p:
+        sizes = p.starmap(
+            write_page,
+            [
+                (
+                    x,
+                    references[x],
+                    {i: symbols[i]["d"] for i in references[x] if i in shared},
+                    self_contained,
+                )
+                for x in files
+            ],
+        )
+
+    bytes_in = sum(path.getsize(path.join(optimize.output_dir, x)) for x in files)
+    bytes_out = sum(sizes)
+    if not self_contained:
+        bytes_out += path.getsize(path.join(glyphs_dir, sprite_file))
+    instances = sum(x["count"] for x in symbols)
+    print(
+        f"{instances} shapes, {len(symbols)} unique, {len(shared)} shared "
+        f"(dedup ratio {instances / len(symbols):.2f}), largest deviation "
+        f"{deviation:.4f}"
+    )
+    print(f"{bytes_in} to {bytes_out} bytes ({1 - bytes_out / bytes_in:.1%} saved)")
+
+    return {
+        "shapes": instances,
+        "symbols": len(symbols),
+        "shared": len(shared),
+        "deviation": deviation,
+        "bytes_in": bytes_in,
+        "bytes_out": bytes_out,
+    }
+
+
+if __name__ == "__main__":
+    dedup_pages(self_contained="--self-contained" in sys.argv)
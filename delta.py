@@ -0,0 +1,258 @@
+import difflib
+import hashlib
+import json
+import re
+import struct
+import sys
+import zlib
+from multiprocessing import Pool
+from os import makedirs, path, remove, stat
+
+import compress
+
+# a bundle is the header followed by zlib compressed JSON, a list of entries
+#   {"name", "kind", "base", "hash", "data"}
+# where base and hash are the SHA-256 of the file before and after, kind is
+#   add     data is the whole new file
+#   delete  the file is removed
+#   tokens  data is a token diff, SVG files are split into elements and other
+#           text into lines
+#   json    data is a field level diff of the parsed file and the index of the
+#           json.dump settings in json_formats that writes it
+magic = b"QPAT"
+version = 1
+header = struct.Struct("<4sH")
+element_start = re.compile(r"(?=<)")
+# the settings the build writes its JSON files with
+json_formats = [
+    {"indent": 4, "sort_keys": True},
+    {"indent": 4, "sort_keys": True, "ensure_ascii": False},
+    {"indent": 4},
+    {"separators": (",", ":")},
+]
+
+
+def file_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def split_tokens(name, text):
+    if name.endswith(".svg"):
+        return [x for x in element_start.split(text) if x]
+    return text.splitlines(keepends=True)
+
+
+def token_diff(old_tokens, new_tokens):
+    # runs copied from the old tokens as [first, last] and new text as strings
+    ops = []
+    matcher = difflib.SequenceMatcher(None, old_tokens, new_tokens, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append("".join(new_tokens[j1:j2]))
+    return ops
+
+
+def apply_tokens(old_tokens, ops):
+    return "".join(
+        "".join(old_tokens[x[0] : x[1]]) if isinstance(x, list) else x for x in ops
+    )
+
+
+def json_diff(old, new):
+    # None if equal, otherwise ["r", value] to replace, ["d", changes, removed]
+    # for objects and ["l", [[index, change], ...]] for lists of the same length
+    if type(old) is not type(new):
+        return ["r", new]
+    if isinstance(old, dict):
+        changes = {}
+        for key, value in new.items():
+            change = json_diff(old[key], value) if key in old else ["r", value]
+            if change is not None:
+                changes[key] = change
+        removed = [x for x in old if x not in new]
+        if len(changes) == 0 and len(removed) == 0:
+            return None
+        return ["d", changes, removed]
+    if isinstance(old, list) and len(old) == len(new):
+        changes = [[i, json_diff(x, y)] for i, (x, y) in enumerate(zip(old, new))]
+        changes = [x for x in changes if x[1] is not None]
+        return ["l", changes] if len(changes) > 0 else None
+    return ["r", new] if old != new else None
+
+
+def apply_json(old, change):
+    if change is None:
+        return old
+    if change[0] == "r":
+        return change[1]
+    if change[0] == "d":
+        out = {x: y for x, y in old.items() if x not in change[2]}
+        for key, value in change[1].items():
+            out[key] = apply_json(old.get(key), value)
+        return out
+    out = list(old)
+    for index, value in change[1]:
+        out[index] = apply_json(old[index], value)
+    return out
+
+
+def json_entry(old_text, new_text):
+    # a field level diff if one of the build's JSON settings writes the result
+    # back byte for byte, otherwise None
+    try:
+        old, new = json.loads(old_text), json.loads(new_text)
+    except ValueError:
+        return None
+
+    change = json_diff(old, new)
+    for index, settings in enumerate(json_formats):
+        if json.dumps(apply_json(old, change), **settings) == new_text:
+            return [index, change]
+    return None
+
+
+def file_delta(item):
+    name, old_dir, new_dir = item
+    with open(path.join(new_dir, name), "rb") as fp:
+        new_data = fp.read()
+    entry = {"name": name, "hash": file_hash(new_data)}
+
+    old_file = path.join(old_dir, name)
+    if not path.exists(old_file):
+        return dict(entry, kind="add", data=new_data.decode("utf-8"))
+
+    with open(old_file, "rb") as fp:
+        old_data = fp.read()
+    if old_data == new_data:
+        return None
+
+    entry["base"] = file_hash(old_data)
+    old_text, new_text = old_data.decode("utf-8"), new_data.decode("utf-8")
+    if name.endswith(".json"):
+        data = json_entry(old_text, new_text)
+        if data is not None:
+            return dict(entry, kind="json", data=data)
+
+    old_tokens = split_tokens(name, old_text)
+    new_tokens = split_tokens(name, new_text)
+    return dict(entry, kind="tokens", data=token_diff(old_tokens, new_tokens))
+
+
+def matches_manifest(directory, name, manifest):
+    # whether compressed.json has an entry for the file and the file on disk
+    # still has the size recorded there, a file edited since is read again
+    filepath = path.join(directory, name)
+    return (
+        name in manifest
+        and path.exists(filepath)
+        and stat(filepath).st_size == manifest[name]["size"]
+    )
+
+
+def unchanged_files(old_dir, new_dir, names):
+    # files both compressed.json manifests list with the same hash, and whose
+    # sizes on disk still match the manifests, are not read at all
+    old_manifest = compress.load_manifest(old_dir)
+    new_manifest = compress.load_manifest(new_dir)
+    return {
+        x
+        for x in names
+        if matches_manifest(old_dir, x, old_manifest)
+        and matches_manifest(new_dir, x, new_manifest)
+        and old_manifest[x]["hash"] == new_manifest[x]["hash"]
+    }
+
+
+def make_delta(old_dir, new_dir):
+    old_names = compress.served_files(old_dir)
+    new_names = compress.served_files(new_dir)
+    skipped = unchanged_files(old_dir, new_dir, new_names)
+    items = [(x, old_dir, new_dir) for x in new_names if x not in skipped]
+
+    with Pool() as p:
+        entries = [x for x in p.imap(file_delta, items, 8) if x is not None]
+
+    for name in sorted(set(old_names) - set(new_names)):
+        with open(path.join(old_dir, name), "rb") as fp:
+            entries.append(
+                {"name": name, "kind": "delete", "base": file_hash(fp.read())}
+            )
+
+    body = json.dumps(entries, separators=(",", ":"), ensure_ascii=False)
+    return header.pack(magic, version) + zlib.compress(body.encode("utf-8"), 9)
+
+
+def read_delta(bundle):
+    bundle_magic, bundle_version = header.unpack_from(bundle)
+    if bundle_magic != magic or bundle_version != version:
+        raise Exception("not a delta bundle")
+    return json.loads(zlib.decompress(bundle[header.size :]).decode("utf-8"))
+
+
+def patched_file(entry, directory):
+    # the new contents of an entry's file, None if it is deleted
+    name = entry["name"]
+    if entry["kind"] == "add":
+        if path.exists(path.join(directory, name)):
+            raise Exception(f"{name} already exists, the delta adds it")
+        data = entry["data"].encode("utf-8")
+        if file_hash(data) != entry["hash"]:
+            raise Exception(f"{name} does not match after applying the delta")
+        return data
+
+    with open(path.join(directory, name), "rb") as fp:
+        old_data = fp.read()
+    if file_hash(old_data) != entry["base"]:
+        raise Exception(f"{name} is not the file the delta was made from")
+    if entry["kind"] == "delete":
+        return None
+
+    if entry["kind"] == "json":
+        index, change = entry["data"]
+        new = apply_json(json.loads(old_data.decode("utf-8")), change)
+        data = json.dumps(new, **json_formats[index]).encode("utf-8")
+    else:
+        tokens = split_tokens(name, old_data.decode("utf-8"))
+        data = apply_tokens(tokens, entry["data"]).encode("utf-8")
+
+    if file_hash(data) != entry["hash"]:
+        raise Exception(f"{name} does not match after applying the delta")
+    return data
+
+
+def apply_delta(bundle, directory, out_dir=None):
+    # rebuilds the changed files from the old ones in directory, in place
+    # unless out_dir is given, and returns their names. Every file is checked
+    # before any is written, so a delta for another build changes nothing
+    out_dir = out_dir or directory
+    entries = read_delta(bundle)
+    files = [(x["name"], patched_file(x, directory)) for x in entries]
+
+    for name, data in files:
+        out_file = path.join(out_dir, name)
+        if data is None:
+            if path.exists(out_file):
+                remove(out_file)
+            continue
+
+        makedirs(path.dirname(out_file), exist_ok=True)
+        with open(out_file, "wb") as fp:
+            fp.write(data)
+
+    return [x[0] for x in files]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 5 and sys.argv[1] == "make":
+        bundle = make_delta(sys.argv[2], sys.argv[3])
+        with open(sys.argv[4], "wb") as fp:
+            fp.write(bundle)
+        print(f"{len(read_delta(bundle))} changed files in {len(bundle)} bytes")
+    elif len(sys.argv) == 4 and sys.argv[1] == "apply":
+        with open(sys.argv[2], "rb") as fp:
+            written = apply_delta(fp.read(), sys.argv[3])
+        print(f"Updated {len(written)} files")
+    else:
+        print("Usage: delta.py make OLD_DIR NEW_DIR BUNDLE | apply BUNDLE DIR")
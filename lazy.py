@@ -0,0 +1,15 @@
+import importlib
+
+
+class LazyModule:
+    # stands in for a module that is slow to import, which is imported on the
+    # first attribute lookup, the attributes are then kept on the instance so
+    # later lookups cost the same as on the module
+
+    def __init__(self, module_name):
+        self.module_name = module_name
+
+    def __getattr__(self, attribute):
+        value = getattr(importlib.import_module(self.module_name), attribute)
+        setattr(self, attribute, value)
+        return value
@@ -1,13 +1,36 @@
-import svgpathtools
-from math import floor
+import hashlib
+import json
+import lazy
+import metrics
+import minify
+import positions
+import regions
+from bisect import bisect_left, bisect_right
+from functools import lru_cache, partial
+from math import floor, inf
+from multiprocessing import Pool
 from os import path, mkdir
 import time
 import sys
 
+# numpy and svgpathtools take most of a second to import, so they are only
+# imported once a page is split and runs with nothing to split never load them
+np = lazy.LazyModule("numpy")
+svgpathtools = lazy.LazyModule("svgpathtools")
+
 debug_mode = False
 svg_dir = path.join(path.dirname(path.realpath(__file__)), "output")
 determinate_ratio = 6
 search_width = 10
+binomials = [[1], [1, 1], [1, 2, 1], [1, 3, 3, 1]]
+# largest distance in viewBox units a line's outline may move when its
+# coordinates are rounded, None writes full precision
+minify_tolerance = 0.01
+line_template = (
+    '<?xml version="1.0" ?>\n<svg xmlns="http://www.w3.org/2000/svg" version="1.1" '
+    'viewBox="0 {y_pos} 345 50" xml:space="preserve">'
+    '<path d="{d}" fill="#000000" fill-rule="evenodd"/></svg>\n'
+)
 
 
 def debug_overlay_path(page_offset, line_height, line):
@@ -22,133 +45,213 @@ def debug_overlay_path(page_offset, line_height, line):
     return svgpathtools.parse_path(p)
 
 
-def indeterminate_path_info(glyph_path, page_offset, line_height):
-    glyph_bounds = glyph_path.bbox()
-    # (xmin, xmax, ymin, ymax)
-    top_y_pos = glyph_bounds[2] - page_offset
-    bottom_y_pos = glyph_bounds[3] - page_offset
+@lru_cache(maxsize=None)
+def flatten_t_values():
+    return np.linspace(0, 1, 65)
 
-    top_line = min(floor(top_y_pos / line_height) + 1, 15)
-    bottom_line = min(floor(bottom_y_pos / line_height) + 1, 15)
 
-    if top_line == bottom_line:
-        if top_y_pos < ((top_line - 0.5) * line_height):
-            top_line = bottom_line - 1
-        else:
-            bottom_line = top_line + 1
+@lru_cache(maxsize=None)
+def sample_t_values():
+    return np.arange(101) * 0.01
 
-    top_distance = top_y_pos - ((top_line - 0.5) * line_height)
-    bottom_distance = ((bottom_line - 0.5) * line_height) - bottom_y_pos
 
-    return glyph_path, (top_line, bottom_line), min(top_distance, bottom_distance)
+class Glyph:
+    # a single subpath of the page, parsed once with its bounding box cached
 
+    def __init__(self, segments):
+        self.path = svgpathtools.Path(*segments)
+        # bounds are in the format (xmin, xmax, ymin, ymax)
+        self.bbox = self.path.bbox()
+        self.samples = None
 
-def path_distance(undetermined_path, _path):
-    min_d = 999
-    min_t = 999
-    for i in range(0, 101):
-        t_val = i * 0.01
-        d = undetermined_path.radialrange(_path.point(t_val))[0][0]
-        if d < min_d:
-            min_d = d
-            min_t = t_val
-    return min_d, min_t
+    def sample(self):
+        if self.samples is None:
+            self.samples = sample_path(self.path)
+        return self.samples
 
 
-def detect_indeterminate_line(glyph_info, lines):
-    top_line = glyph_info[1][0]
-    bottom_line = glyph_info[1][1]
-    glyph_path = glyph_info[0]
-    glyph_box = glyph_path.bbox()
-    glyph_min = glyph_box[0] - search_width
-    glyph_max = glyph_box[1] + search_width
-
-    if top_line != 1 or bottom_line != 2 or glyph_min < 250:
-        return None, None
-
-    def within_bounds(comparison_path, x_min, x_max):
-        comp = comparison_path.bbox()
-        left_check = x_min <= comp[0] <= x_max
-        right_check = x_min <= comp[1] <= x_max
-        overlap_check = comp[0] <= x_min and comp[1] >= x_max
-        return left_check or right_check or overlap_check
-
-    top_paths = lines[top_line].d().split("M")
-    top_paths = filter(lambda x: len(x.strip()) > 0, top_paths)
-    top_paths = map(lambda x: svgpathtools.parse_path(f"M{x}"), top_paths)
-    top_paths = filter(lambda x: within_bounds(x, glyph_min, glyph_max), top_paths)
-    top_paths = list(top_paths)
-
-    bottom_paths = lines[bottom_line].d().split("M")
-    bottom_paths = filter(lambda x: len(x.strip()) > 0, bottom_paths)
-    bottom_paths = map(lambda x: svgpathtools.parse_path(f"M{x}"), bottom_paths)
-    bottom_paths = filter(lambda x: within_bounds(x, glyph_min, glyph_max), bottom_paths)
-    bottom_paths = list(bottom_paths)
-
-    def min_distance(undetermined_path, comparison_paths):
-        minimum_distance = 999999999
-        nearest_point = None
-        for _path in comparison_paths:
-            distance, t = path_distance(undetermined_path, _path)
-            if distance < minimum_distance:
-                minimum_distance = distance
-                nearest_point = _path.point(t)
-
-        return minimum_distance, nearest_point
-
-    top_distance, nearest_top_point = min_distance(glyph_path, top_paths)
-    bottom_distance, nearest_bottom_point = min_distance(glyph_path, bottom_paths)
+def split_glyphs(paths):
+    # a new glyph starts wherever a segment does not continue the previous one
+    glyphs = []
+    segments = []
+    for _path in paths:
+        for segment in _path:
+            if len(segments) > 0 and segment.start != segments[-1].end:
+                glyphs.append(Glyph(segments))
+                segments = []
+            segments.append(segment)
 
-    if top_distance < bottom_distance:
-        return top_line, nearest_top_point
-    else:
-        return bottom_line, nearest_bottom_point
+    if len(segments) > 0:
+        glyphs.append(Glyph(segments))
 
+    return glyphs
 
-def detect_line_number(glyph_bounds, page_offset, line_height):
-    top_y_pos = glyph_bounds[2] - page_offset
-    bottom_y_pos = glyph_bounds[3] - page_offset
 
-    top_line = min(floor(top_y_pos / line_height) + 1, 15)
-    bottom_line = min(floor(bottom_y_pos / line_height) + 1, 15)
+class LineIndex:
+    # glyphs of a line kept sorted by their left edge for x-range lookups
 
-    buffer_height = (line_height / determinate_ratio)
-    top_line_mid = (top_line - 0.5) * line_height
-    bottom_line_mid = (bottom_line - 0.5) * line_height
+    def __init__(self):
+        self.glyphs = []
+        self.keys = []
+        self.sorted_glyphs = []
+        self.max_width = 0
 
-    top_line_bounds = (top_line_mid + buffer_height, top_line_mid - buffer_height)
-    bottom_line_bounds = (bottom_line_mid + buffer_height, bottom_line_mid - buffer_height)
+    def __len__(self):
+        return len(self.glyphs)
 
-    # shortcut for line 1 if top of path is above determination point
-    if top_line == 1 and top_y_pos <= top_line_bounds[0]:
-        return top_line
+    def add(self, glyph):
+        key = (glyph.bbox[0], len(self.glyphs))
+        position = bisect_right(self.keys, key)
+        self.keys.insert(position, key)
+        self.sorted_glyphs.insert(position, glyph)
+        self.glyphs.append(glyph)
+        self.max_width = max(self.max_width, glyph.bbox[1] - glyph.bbox[0])
 
-    # shortcut for line 15 if bottom of path is below determination point
-    if bottom_line == 15 and bottom_y_pos >= bottom_line_bounds[1]:
-        return bottom_line
+    def overlapping(self, x_min, x_max):
+        # glyphs starting further left than the widest glyph can't reach x_min
+        start = bisect_left(self.keys, (x_min - self.max_width,))
+        end = bisect_right(self.keys, (x_max, inf))
+        found = [
+            (key[1], glyph)
+            for key, glyph in zip(self.keys[start:end], self.sorted_glyphs[start:end])
+            if glyph.bbox[1] >= x_min
+        ]
+        return [glyph for _, glyph in sorted(found, key=lambda x: x[0])]
 
-    # check if top or bottom of path is within top line determination bounds
-    if top_line_bounds[0] >= top_y_pos >= top_line_bounds[1] or \
-       top_line_bounds[0] >= bottom_y_pos >= top_line_bounds[1]:
-        return top_line
 
-    # check if top or bottom of path is within bottom line determination bounds
-    if bottom_line_bounds[0] >= top_y_pos >= bottom_line_bounds[1] or \
-       bottom_line_bounds[0] >= bottom_y_pos >= bottom_line_bounds[1]:
-        return bottom_line
+def join_glyphs(glyphs):
+    return svgpathtools.Path(*[x for glyph in glyphs for x in glyph.path])
 
-    # check if middle of path is within top line determination bounds
-    if top_y_pos <= top_line_bounds[0] and bottom_y_pos >= top_line_bounds[1]:
-        return top_line
 
-    # check if middle of path is within bottom line determination bounds
-    if top_y_pos <= bottom_line_bounds[0] and bottom_y_pos >= bottom_line_bounds[1]:
-        return bottom_line
+def segment_points(segment, t_values):
+    if isinstance(segment, svgpathtools.Arc):
+        return np.array([segment.point(t) for t in t_values])
 
-    return None
+    # lines and beziers are evaluated for every t at once as Bernstein polynomials
+    control_points = segment.bpoints()
+    degree = len(control_points) - 1
+    points = np.zeros(len(t_values), dtype=complex)
+    for k, control_point in enumerate(control_points):
+        weight = binomials[degree][k] * (1 - t_values) ** (degree - k) * t_values**k
+        points += weight * control_point
+    return points
 
 
-def extract_lines(filepath, page_dir):
+def flatten_path(_path):
+    # polyline edges as (starts, ends) arrays approximating every segment
+    starts = []
+    ends = []
+    for segment in _path:
+        if isinstance(segment, svgpathtools.Line):
+            points = np.array([segment.start, segment.end])
+        else:
+            points = segment_points(segment, flatten_t_values())
+        starts.append(points[:-1])
+        ends.append(points[1:])
+    return np.concatenate(starts), np.concatenate(ends)
+
+
+def sample_path(_path):
+    # same points as _path.point(t) for t in 0, 0.01, ..., 1
+    t_values = sample_t_values()
+    lengths = [segment.length() for segment in _path]
+    total_length = sum(lengths)
+    if total_length > 0:
+        lengths = [x / total_length for x in lengths]
+    segment_ends = np.cumsum(lengths)
+    segment_starts = np.concatenate(([0], segment_ends[:-1]))
+
+    indices = np.searchsorted(segment_ends, t_values)
+    indices = np.minimum(indices, len(lengths) - 1)
+    indices[0] = 0
+    indices[-1] = len(lengths) - 1
+
+    points = np.zeros(len(t_values), dtype=complex)
+    for index in np.unique(indices):
+        mask = indices == index
+        start, end = segment_starts[index], segment_ends[index]
+        if end > start:
+            segment_t_values = (t_values[mask] - start) / (end - start)
+        else:
+            segment_t_values = np.zeros(mask.sum())
+        points[mask] = segment_points(_path[index], segment_t_values)
+    points[0] = _path[0].point(0.0)
+    points[-1] = _path[-1].point(1.0)
+    return points
+
+
+def path_distance(outline, points):
+    # distance from every point to the nearest edge of a flattened outline
+    starts, ends = outline
+    edges = ends - starts
+    offsets = points[:, None] - starts[None, :]
+    squared_lengths = np.abs(edges) ** 2
+    projection = np.real(offsets * np.conj(edges)) / np.where(
+        squared_lengths > 0, squared_lengths, 1
+    )
+    projection = np.clip(projection, 0, 1)
+    return np.abs(offsets - projection * edges).min(axis=1)
+
+
+def nearest_point(outline, points, chunk_size=64):
+    # the distance to the outline's bounding box is a lower bound, so points are
+    # measured nearest box first until no remaining point can be any closer
+    starts, ends = outline
+    vertices = np.concatenate([starts, ends])
+    dx = np.maximum(vertices.real.min() - points.real, 0)
+    dx = np.maximum(dx, points.real - vertices.real.max())
+    dy = np.maximum(vertices.imag.min() - points.imag, 0)
+    dy = np.maximum(dy, points.imag - vertices.imag.max())
+    lower_bounds = np.hypot(dx, dy)
+
+    order = np.argsort(lower_bounds, kind="stable")
+    best = (inf, -1)
+    for chunk_start in range(0, len(order), chunk_size):
+        chunk = order[chunk_start : chunk_start + chunk_size]
+        if lower_bounds[chunk[0]] > best[0]:
+            break
+        distances = path_distance(outline, points[chunk])
+        best = min(best, *zip(distances, chunk))
+
+    return best
+
+
+def detect_indeterminate_line(glyph_info, lines):
+    top_line = glyph_info[1][0]
+    bottom_line = glyph_info[1][1]
+    glyph = glyph_info[0]
+    glyph_min = glyph.bbox[0] - search_width
+    glyph_max = glyph.bbox[1] + search_width
+
+    # glyphs above the first or below the last line only have one option
+    if top_line not in lines:
+        return bottom_line, None
+    if bottom_line not in lines:
+        return top_line, None
+
+    top_paths = lines[top_line].overlapping(glyph_min, glyph_max)
+    bottom_paths = lines[bottom_line].overlapping(glyph_min, glyph_max)
+
+    def min_distance(outline, comparison_glyphs):
+        if len(comparison_glyphs) == 0:
+            return 999999999, None
+
+        # every comparison glyph is sampled and measured in a single batch
+        points = np.concatenate([x.sample() for x in comparison_glyphs])
+        distance, nearest = nearest_point(outline, points)
+        return distance, complex(points[nearest])
+
+    outline = flatten_path(glyph.path)
+    top_distance, nearest_top_point = min_distance(outline, top_paths)
+    bottom_distance, nearest_bottom_point = min_distance(outline, bottom_paths)
+
+    if top_distance < bottom_distance:
+        return top_line, nearest_top_point
+    else:
+        return bottom_line, nearest_bottom_point
+
+
+def load_page(filepath):
     doc = svgpathtools.Document(filepath)
     content_group = doc.get_group([None, "content"])
 
@@ -157,47 +260,96 @@ def extract_lines(filepath, page_dir):
 
     line_height = (page_bounds[3] - page_bounds[2]) / 15
 
+    return split_glyphs(doc.paths()), page_bounds[2], line_height
+
+
+def classify_bounds(bounds, page_offset, line_height):
+    # the line of every glyph in an array of bounds at once. Line 0 means
+    # indeterminate, for those the candidate lines and the distance to the
+    # nearer midline are filled in. test_line_split.py keeps the original one
+    # glyph at a time rules these have to match exactly
+    top_y_pos = bounds[:, 2] - page_offset
+    bottom_y_pos = bounds[:, 3] - page_offset
+
+    top_line = np.minimum(np.floor(top_y_pos / line_height) + 1, 15)
+    bottom_line = np.minimum(np.floor(bottom_y_pos / line_height) + 1, 15)
+
+    buffer_height = line_height / determinate_ratio
+    top_line_mid = (top_line - 0.5) * line_height
+    bottom_line_mid = (bottom_line - 0.5) * line_height
+    top_upper, top_lower = top_line_mid + buffer_height, top_line_mid - buffer_height
+    bottom_upper = bottom_line_mid + buffer_height
+    bottom_lower = bottom_line_mid - buffer_height
+
+    # the line checks in order, the first that holds wins
+    conditions = [
+        (top_line == 1) & (top_y_pos <= top_upper),
+        (bottom_line == 15) & (bottom_y_pos >= bottom_lower),
+        ((top_upper >= top_y_pos) & (top_y_pos >= top_lower))
+        | ((top_upper >= bottom_y_pos) & (bottom_y_pos >= top_lower)),
+        ((bottom_upper >= top_y_pos) & (top_y_pos >= bottom_lower))
+        | ((bottom_upper >= bottom_y_pos) & (bottom_y_pos >= bottom_lower)),
+        (top_y_pos <= top_upper) & (bottom_y_pos >= top_lower),
+        (top_y_pos <= bottom_upper) & (bottom_y_pos >= bottom_lower),
+    ]
+    choices = [top_line, bottom_line] * 3
+    line_numbers = np.select(conditions, choices, 0).astype(int)
+
+    same_line = top_line == bottom_line
+    above_mid = top_y_pos < top_line_mid
+    top_line = np.where(same_line & above_mid, bottom_line - 1, top_line)
+    bottom_line = np.where(same_line & ~above_mid, top_line + 1, bottom_line)
+    top_distance = top_y_pos - ((top_line - 0.5) * line_height)
+    bottom_distance = ((bottom_line - 0.5) * line_height) - bottom_y_pos
+    distances = np.minimum(top_distance, bottom_distance)
+
+    candidates = np.stack([top_line, bottom_line], axis=1).astype(int)
+    return line_numbers, candidates, distances
+
+
+def classify_glyphs(glyphs, page_offset, line_height):
     lines = {}
-    debug_lines = {}
-    debug_nodes = {}
     for line_number in range(1, 16):
-        lines[line_number] = svgpathtools.Path()
-        debug_lines[line_number] = svgpathtools.Path()
-        debug_nodes[line_number] = []
+        lines[line_number] = LineIndex()
 
-    full_path = svgpathtools.Path()
-    for doc_path in doc.paths():
-        for sub_path in doc_path:
-            full_path.append(sub_path)
+    bounds = np.array([x.bbox for x in glyphs], dtype=float).reshape(-1, 4)
+    line_numbers, candidates, distances = classify_bounds(
+        bounds, page_offset, line_height
+    )
 
     indeterminate_paths = []
-    for _path in full_path.d().split("M"):
-        if len(_path.strip()) > 0:
-            glyph_path = svgpathtools.parse_path(f"M{_path}")
-            line_number = detect_line_number(glyph_path.bbox(), page_bounds[2], line_height)
-            if line_number:
-                for path_command in glyph_path:
-                    lines[line_number].append(path_command)
-            else:
-                indeterminate_paths.append(glyph_path)
-
-    indeterminate_paths = [indeterminate_path_info(p, page_bounds[2], line_height) for p in indeterminate_paths]
-    indeterminate_num = len(indeterminate_paths)
-    print(f"Found {indeterminate_num} indeterminate paths")
+    for glyph, line_number, candidate, distance in zip(
+        glyphs, line_numbers.tolist(), candidates.tolist(), distances.tolist()
+    ):
+        if line_number:
+            lines[line_number].add(glyph)
+        else:
+            indeterminate_paths.append((glyph, tuple(candidate), distance))
 
     indeterminate_paths.sort(key=lambda x: x[2])
 
-    for i, indeterminate_path in enumerate(indeterminate_paths):
-        start_time = time.time()
+    return lines, indeterminate_paths
+
+
+def resolve_indeterminate(lines, indeterminate_paths):
+    debug_lines = {}
+    debug_nodes = {}
+    for line_number in range(1, 16):
+        debug_lines[line_number] = []
+        debug_nodes[line_number] = []
+
+    for indeterminate_path in indeterminate_paths:
         determination = detect_indeterminate_line(indeterminate_path, lines)
         if determination[0]:
             if determination[1]:
                 debug_nodes[determination[0]].append(determination[1])
-            for path_command in indeterminate_path[0]:
-                lines[determination[0]].append(path_command)
-                debug_lines[determination[0]].append(path_command)
-        print(f"Completed {i+1}/{indeterminate_num} path determations in {time.time() - start_time:.2} seconds")
+            lines[determination[0]].add(indeterminate_path[0])
+            debug_lines[determination[0]].append(indeterminate_path[0])
+
+    return debug_lines, debug_nodes
 
+
+def write_lines(page_dir, lines, debug_lines, debug_nodes, tolerance):
     attribs = {
         "fill": "#000000",
         "fill-rule": "evenodd"
@@ -216,61 +368,361 @@ def extract_lines(filepath, page_dir):
         "height": ""
     }
 
-    for svg_line in lines.items():
-        if len(svg_line[1]) == 0:
+    bytes_full = 0
+    bytes_out = 0
+    max_deviation = 0
+    for line_number, line_index in lines.items():
+        line_glyphs = line_index.glyphs
+        if len(line_glyphs) == 0:
             continue
 
-        line_number = svg_line[0]
-        y_pos = floor(svg_line[1].bbox()[2])
+        y_pos = floor(min(x.bbox[2] for x in line_glyphs))
         svg_attribs["viewBox"] = f"0 {y_pos} 345 50"
         filename = path.join(page_dir, f"{line_number}.svg")
 
-        _paths = [svg_line[1]]
+        if not debug_mode:
+            # lines are in viewBox units already, so no scale applies
+            path_definition = join_glyphs(line_glyphs).d()
+            bytes_full += len(path_definition)
+            if tolerance is not None:
+                path_definition, deviation = minify.minify_path(
+                    path_definition, tolerance
+                )
+                max_deviation = max(max_deviation, deviation)
+            bytes_out += len(path_definition)
+
+            with open(filename, "w") as fp:
+                fp.write(line_template.format(y_pos=y_pos, d=path_definition))
+            continue
+
+        _paths = [join_glyphs(line_glyphs)]
         _attribs = [attribs]
-        _nodes = []
-        if debug_mode:
-            _nodes = debug_nodes[line_number]
-            if len(debug_lines[line_number]) > 0:
-                _paths.append(debug_lines[line_number])
-                _attribs.append(debug_attribs)
+        _nodes = debug_nodes[line_number]
+        if len(debug_lines[line_number]) > 0:
+            _paths.append(join_glyphs(debug_lines[line_number]))
+            _attribs.append(debug_attribs)
 
         svgpathtools.wsvg(_paths, filename=filename, attributes=_attribs, svg_attributes=svg_attribs, nodes=_nodes)
 
-    if debug_mode:
-        filename = path.join(page_dir, "debug.svg")
-        debug_paths = [full_path]
-        svg_attribs["viewBox"] = "0 0 345 550"
-        _attribs = [attribs]
-        for line in range(1, 16):
-            debug_paths.append(debug_overlay_path(page_bounds[2], line_height, line))
-            _attribs.append(debug_attribs)
+    return bytes_full, bytes_out, max_deviation
 
-        svgpathtools.wsvg(debug_paths, filename=filename, attributes=_attribs, svg_attributes=svg_attribs, )
 
+def write_debug_page(page_dir, glyphs, page_offset, line_height):
+    attribs = {
+        "fill": "#000000",
+        "fill-rule": "evenodd"
+    }
+
+    debug_attribs = {
+        "stroke": "#FF0000",
+        "stroke-width": "0.5",
+        "fill-opacity": "0"
+    }
+
+    svg_attribs = {
+        "xml:space": "preserve",
+        "viewBox": "0 0 345 550",
+        "width": "",
+        "height": ""
+    }
 
-def process_svg_file(page):
+    filename = path.join(page_dir, "debug.svg")
+    debug_paths = [join_glyphs(glyphs)]
+    _attribs = [attribs]
+    for line in range(1, 16):
+        debug_paths.append(debug_overlay_path(page_offset, line_height, line))
+        _attribs.append(debug_attribs)
+
+    svgpathtools.wsvg(debug_paths, filename=filename, attributes=_attribs, svg_attributes=svg_attribs, )
+
+
+@lru_cache(maxsize=1)
+def cached_regions(filepath, modified):
+    return regions.load_regions(filepath)
+
+
+def page_region_index(page):
+    # regions are written by optimize, without them pages are split into lines
+    # but not into ayahs
+    filepath = path.join(svg_dir, "regions.json")
+    if not path.exists(filepath):
+        return None
+    return cached_regions(filepath, path.getmtime(filepath)).get(page)
+
+
+def segment_ayahs(page, lines, page_offset, line_height, region_index, markers):
+    # glyphs of an ayah marker go to the ayah it ends, any other glyph to the
+    # ayah region under its centre, on the line it was assigned to
+    glyphs = [(x, y) for x, line in lines.items() for y in line.glyphs]
+    frames = [
+        (glyph.bbox, region_index.point(mx, my))
+        for _, glyph in glyphs
+        for mx, my in markers
+        if glyph.bbox[0] <= mx <= glyph.bbox[1] and glyph.bbox[2] <= my <= glyph.bbox[3]
+    ]
+
+    # the opening pages have 7 lines, glyph centres place them within those
+    xs = [(x.bbox[0] + x.bbox[1]) / 2 for _, x in glyphs]
+    if page < 3:
+        ys = [(x.bbox[2] + x.bbox[3]) / 2 for _, x in glyphs]
+    else:
+        ys = [page_offset + (x - 0.5) * line_height for x, _ in glyphs]
+    found = region_index.points(xs, ys)
+
+    ayahs = {}
+    for (line_number, glyph), region in zip(glyphs, found):
+        xmin, xmax, ymin, ymax = glyph.bbox
+        ayah = None
+        for bbox, frame_ayah in frames:
+            if bbox[0] <= xmin and xmax <= bbox[1]:
+                if bbox[2] <= ymin and ymax <= bbox[3]:
+                    ayah = frame_ayah
+                    break
+        if ayah is None and region >= 0:
+            ayah = tuple(region_index.regions[region][4:6])
+        if ayah is None:
+            continue
+
+        bounds = ayahs.setdefault(ayah, {}).setdefault(line_number, [inf, -inf] * 2)
+        bounds[:] = [
+            min(bounds[0], xmin),
+            max(bounds[1], xmax),
+            min(bounds[2], ymin),
+            max(bounds[3], ymax),
+        ]
+
+    return [
+        {
+            "surah": surah,
+            "ayah": ayah,
+            "rects": [
+                [round(x, 2) for x in (b[0], b[2], b[1], b[3])]
+                for _, b in sorted(ayahs[(surah, ayah)].items())
+            ],
+        }
+        for surah, ayah in sorted(ayahs)
+    ]
+
+
+def write_ayahs(page_dir, ayahs):
+    with open(path.join(page_dir, "ayahs.json"), "w") as fp:
+        json.dump(ayahs, fp, separators=(",", ":"))
+
+
+def extract_lines(
+    filepath, page_dir, page_metrics, page=None, tolerance=minify_tolerance
+):
+    with metrics.stage(page_metrics, "load"):
+        glyphs, page_offset, line_height = load_page(filepath)
+    with metrics.stage(page_metrics, "classify"):
+        lines, indeterminate_paths = classify_glyphs(glyphs, page_offset, line_height)
+    with metrics.stage(page_metrics, "indeterminate"):
+        debug_lines, debug_nodes = resolve_indeterminate(lines, indeterminate_paths)
+    with metrics.stage(page_metrics, "write"):
+        bytes_full, bytes_out, deviation = write_lines(
+            page_dir, lines, debug_lines, debug_nodes, tolerance
+        )
+
+        if debug_mode:
+            write_debug_page(page_dir, glyphs, page_offset, line_height)
+
+    ayahs = []
+    region_index = page_region_index(page) if page is not None else None
+    if region_index is not None:
+        with metrics.stage(page_metrics, "ayahs"):
+            _, markers = positions.read_markers(filepath)
+            ayahs = segment_ayahs(
+                page, lines, page_offset, line_height, region_index, markers
+            )
+            write_ayahs(page_dir, ayahs)
+
+    metrics.count(
+        page_metrics,
+        bytes_in=path.getsize(filepath),
+        bytes_full=bytes_full,
+        bytes_out=bytes_out,
+        max_deviation=deviation,
+        glyphs=len(glyphs),
+        indeterminate=len(indeterminate_paths),
+        lines=len([x for x in lines.values() if len(x) > 0]),
+        ayahs=len(ayahs),
+    )
+
+    return len(indeterminate_paths)
+
+
+def process_svg_file(page, profile_dir=None, tolerance=minify_tolerance):
     start_time = time.time()
 
-    svg_file = f"{page_number:03}.svg"
+    svg_file = f"{page:03}.svg"
     filepath = path.join(svg_dir, svg_file)
     page_dir = path.join(svg_dir, svg_file.replace(".svg", ""))
 
     if not path.exists(page_dir):
         mkdir(page_dir)
 
-    extract_lines(filepath, page_dir)
+    page_metrics = metrics.new_metrics("line_split", page)
+    with metrics.profiled(metrics.profile_file(profile_dir, "line_split", page)):
+        indeterminate_num = extract_lines(
+            filepath, page_dir, page_metrics, page, tolerance
+        )
+
+    return {
+        "page": page,
+        "indeterminate": indeterminate_num,
+        "seconds": round(time.time() - start_time, 2),
+        "metrics": page_metrics,
+    }
+
+
+def process_page(page, profile_dir=None, tolerance=minify_tolerance):
+    # a failing page is reported in the summary instead of aborting the batch
+    try:
+        return process_svg_file(page, profile_dir, tolerance)
+    except Exception as e:
+        return {"page": page, "error": f"{type(e).__name__}: {e}"}
+
+
+def load_summary():
+    summary_file = path.join(svg_dir, "line_split.json")
+    if not path.exists(summary_file):
+        return {}
+
+    with open(summary_file) as fp:
+        return {x["page"]: x for x in json.load(fp)}
+
+
+def save_summary(summary):
+    with open(path.join(svg_dir, "line_split.json"), "w") as fp:
+        json.dump([summary[x] for x in sorted(summary)], fp, indent=4)
 
-    print(f"page {svg_file} finished in {(time.time() - start_time) / 60:.2} minutes")
+
+def code_version(tolerance):
+    # a change to the split, minify or region code invalidates every cached page
+    digest = hashlib.sha256()
+    modules = [__file__, minify.__file__, positions.__file__, regions.__file__]
+    for module_file in modules:
+        with open(path.realpath(module_file), "rb") as fp:
+            digest.update(fp.read())
+    digest.update(f"{tolerance} {debug_mode}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def page_key(page, version):
+    # the page's regions are part of the key so new markers redo its ayahs
+    region_index = page_region_index(page)
+    page_regions = region_index.regions if region_index is not None else None
+    digest = hashlib.sha256()
+    with open(path.join(svg_dir, f"{page:03}.svg"), "rb") as fp:
+        digest.update(fp.read())
+    digest.update(version.encode("utf-8"))
+    digest.update(json.dumps(page_regions).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def page_cost(page, summary):
+    # indeterminate paths dominate a page's run time, so the counts from the
+    # previous run order the work, with the page size breaking ties
+    indeterminate_num = summary.get(page, {}).get("indeterminate", 0)
+    return indeterminate_num, path.getsize(path.join(svg_dir, f"{page:03}.svg"))
+
+
+def longest_first(pages, summary):
+    return sorted(pages, key=lambda x: page_cost(x, summary), reverse=True)
+
+
+def process_svg_files(
+    pages, profile=False, force=False, pool=None, tolerance=minify_tolerance
+):
+    start_time = time.time()
+    summary = load_summary()
+
+    # skip pages whose source, regions and split code are unchanged
+    version = code_version(tolerance)
+    keys = {x: page_key(x, version) for x in pages}
+    all_pages = pages
+    pages = [
+        x
+        for x in pages
+        if force
+        or summary.get(x, {}).get("key") != keys[x]
+        or not path.exists(path.join(svg_dir, f"{x:03}"))
+    ]
+    print(f"Splitting {len(pages)} of {len(all_pages)} pages")
+
+    pages = longest_first(pages, summary)
+    profile_dir = path.join(svg_dir, "profile") if profile else None
+
+    # the tolerance goes with every task, workers started by spawn would only
+    # see the module default
+    task = partial(process_page, profile_dir=profile_dir, tolerance=tolerance)
+    if pool is None:
+        with Pool() as p:
+            results = list(p.imap_unordered(task, pages))
+    else:
+        results = list(pool.imap_unordered(task, pages))
+
+    records = [x.pop("metrics") for x in results if "metrics" in x]
+    metrics.write_report(records, path.join(svg_dir, "line_split_metrics.jsonl"))
+
+    for result in results:
+        if "error" not in result:
+            result["key"] = keys[result["page"]]
+        summary[result["page"]] = result
+    save_summary(summary)
+
+    failures = [x for x in results if "error" in x]
+    completed = sorted(
+        [x for x in results if "error" not in x], key=lambda x: -x["seconds"]
+    )
+    print(
+        f"{len(completed)}/{len(pages)} pages finished in "
+        f"{(time.time() - start_time) / 60:.2} minutes"
+    )
+    metrics.print_slowest(records)
+    if tolerance is not None and len(records) > 0:
+        minify.print_savings(records)
+    for result in sorted(failures, key=lambda x: x["page"]):
+        print(f"  page {result['page']:03} failed: {result['error']}")
+
+    return results
+
+
+def parse_pages(argument):
+    if argument == "all":
+        return list(range(1, 605))
+
+    first, _, last = argument.partition("-")
+    first = int(first)
+    last = int(last) if last else first
+    if first < 1 or last > 604 or first > last:
+        raise ValueError("Page number out of bounds")
+    return list(range(first, last + 1))
 
 
 if __name__ == "__main__":
-    if len(sys.argv) == 2:
+    profile = "--profile" in sys.argv
+    force = "--force" in sys.argv
+    tolerance = minify.parse_tolerance(sys.argv[1:], minify_tolerance)
+    arguments = [x for x in sys.argv[1:] if not x.startswith("--")]
+    if len(arguments) == 1:
         try:
-            page_number = int(sys.argv[1])
-            if page_number > 604 or page_number < 1:
-                raise ValueError('Page number out of bounds')
-            process_svg_file(page_number)
+            pages = parse_pages(arguments[0])
         except ValueError:
             print("Invalid page number, must be an integer from 1 to 604")
+        else:
+            if len(pages) == 1:
+                profile_dir = path.join(svg_dir, "profile") if profile else None
+                result = process_svg_file(pages[0], profile_dir, tolerance)
+                print(
+                    f"page {pages[0]:03}.svg finished in "
+                    f"{result['seconds'] / 60:.2} minutes, "
+                    f"{result['indeterminate']} indeterminate paths"
+                )
+            else:
+                process_svg_files(pages, profile, force, tolerance=tolerance)
     else:
-        print("Usage: line_split.py PAGE_NUMBER")
+        print(
+            "Usage: line_split.py PAGE_NUMBER | FIRST-LAST | all "
+            "[--profile] [--force] [--tolerance=VALUE] [--no-minify]"
+        )
@@ -0,0 +1,122 @@
+import http.client
+import random
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+import compress
+import server
+
+
+def request_paths(directory):
+    return ["/" + x for x in compress.served_files(directory)]
+
+
+def run_client(host, port, paths, deadline, conditional, seed, results):
+    # one keep-alive connection requesting random files until the deadline,
+    # revalidating with the ETag of an earlier response when conditional
+    rng = random.Random(seed)
+    connection = http.client.HTTPConnection(host, port)
+    etags = {}
+    latencies = []
+    statuses = {}
+    received = 0
+
+    while time.perf_counter() < deadline:
+        request_path = rng.choice(paths)
+        headers = {}
+        if conditional and request_path in etags:
+            headers["If-None-Match"] = etags[request_path]
+
+        start_time = time.perf_counter()
+        connection.request("GET", request_path, headers=headers)
+        response = connection.getresponse()
+        body = response.read()
+        latencies.append(time.perf_counter() - start_time)
+
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+        received += len(body)
+        if response.getheader("ETag") is not None:
+            etags[request_path] = response.getheader("ETag")
+
+    connection.close()
+    results.append((latencies, statuses, received))
+
+
+def load_test(host, port, paths, seconds=10, concurrency=8, conditional=False):
+    results = []
+    deadline = time.perf_counter() + seconds
+    threads = [
+        threading.Thread(
+            target=run_client,
+            args=(host, port, paths, deadline, conditional, x, results),
+        )
+        for x in range(concurrency)
+    ]
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start_time
+
+    latencies = sorted(x for result in results for x in result[0])
+    statuses = {}
+    for _, counts, _ in results:
+        for status, count in counts.items():
+            statuses[status] = statuses.get(status, 0) + count
+
+    def percentile(q):
+        return latencies[int(q * (len(latencies) - 1))] * 1000 if latencies else 0
+
+    return {
+        "requests": len(latencies),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "megabytes_per_second": round(
+            sum(x[2] for x in results) / elapsed / 1024 / 1024, 2
+        ),
+        "statuses": statuses,
+        "latency_ms": {
+            "p50": round(percentile(0.5), 3),
+            "p99": round(percentile(0.99), 3),
+        },
+    }
+
+
+if __name__ == "__main__":
+    # without --url a server over output/ is started in this process
+    url = None
+    seconds = 10
+    concurrency = 8
+    for argument in sys.argv[1:]:
+        if argument.startswith("--url="):
+            url = argument.split("=", 1)[1]
+        elif argument.startswith("--seconds="):
+            seconds = float(argument.split("=")[1])
+        elif argument.startswith("--concurrency="):
+            concurrency = int(argument.split("=")[1])
+
+    page_server = None
+    if url is None:
+        page_server = server.PageServer(("127.0.0.1", 0))
+        threading.Thread(target=page_server.serve_forever, daemon=True).start()
+        host, port = page_server.server_address
+    else:
+        parsed = urlparse(url)
+        host, port = parsed.hostname, parsed.port or 80
+
+    paths = request_paths(server.output_dir)
+    result = load_test(
+        host, port, paths, seconds, concurrency, "--conditional" in sys.argv
+    )
+    print(
+        f"{result['requests']} requests over {len(paths)} files, "
+        f"{result['requests_per_second']} requests/second, "
+        f"{result['megabytes_per_second']} MB/second, "
+        f"latency p50 {result['latency_ms']['p50']:.2f} ms, "
+        f"p99 {result['latency_ms']['p99']:.2f} ms, statuses {result['statuses']}"
+    )
+    if page_server is not None:
+        print(f"server cache hit rate {page_server.stats()['cache']['hit_rate']:.1%}")
+        page_server.shutdown()
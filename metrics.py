@@ -0,0 +1,61 @@
+import cProfile
+import json
+import time
+from contextlib import contextmanager
+from os import makedirs, path
+
+
+def new_metrics(entry, page):
+    return {"entry": entry, "page": page, "seconds": 0, "stages": {}, "counters": {}}
+
+
+@contextmanager
+def stage(metrics, name):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start_time
+        metrics["stages"][name] = round(metrics["stages"].get(name, 0) + seconds, 4)
+        metrics["seconds"] = round(sum(metrics["stages"].values()), 4)
+
+
+def count(metrics, **counters):
+    metrics["counters"].update(counters)
+
+
+def profile_file(profile_dir, entry, page):
+    if profile_dir is None:
+        return None
+
+    makedirs(profile_dir, exist_ok=True)
+    return path.join(profile_dir, f"{entry}-{page:03}.prof")
+
+
+@contextmanager
+def profiled(filepath):
+    # dumps a cProfile of the block for pstats or snakeviz when a file is given
+    if filepath is None:
+        yield
+        return
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(filepath)
+
+
+def write_report(records, filepath):
+    # one JSON object per page so reports can be streamed and concatenated
+    with open(filepath, "w") as fp:
+        for record in sorted(records, key=lambda x: x["page"]):
+            fp.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+def print_slowest(records, limit=5):
+    for record in sorted(records, key=lambda x: -x["seconds"])[:limit]:
+        stages = ", ".join(f"{x} {y:.2f}" for x, y in record["stages"].items())
+        print(f"  page {record['page']:03}: {record['seconds']:.2f} seconds ({stages})")
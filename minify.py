@@ -0,0 +1,221 @@
+import re
+from math import ceil, hypot, log10, sqrt
+
+path_token = re.compile(
+    r"([MmZzLlHhVvCcSsQqTtAa])|([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)"
+)
+parameter_counts = {"M": 2, "L": 2, "H": 1, "V": 1, "C": 6, "S": 4, "Q": 4, "T": 2}
+
+
+def path_commands(path_definition):
+    # yields (command, numbers) with repeated parameter groups split up
+    commands = []
+    for command, number in path_token.findall(path_definition):
+        if command:
+            if command in "Aa":
+                raise Exception("arc commands are not supported")
+            commands.append((command, []))
+        else:
+            commands[-1][1].append(float(number))
+
+    for command, numbers in commands:
+        if command in "Zz":
+            yield command, numbers
+            continue
+
+        count = parameter_counts[command.upper()]
+        for i in range(0, len(numbers), count):
+            # pairs following a moveto are implicit linetos
+            if i > 0 and command in "Mm":
+                command = "L" if command == "M" else "l"
+            yield command, numbers[i : i + count]
+
+
+def absolute_segments(path_definition):
+    # returns (command, points) in absolute coordinates using only M, L, C, Q
+    # and Z so differently written paths can be compared point by point
+    segments = []
+    x, y = 0, 0
+    start = (0, 0)
+    previous = None
+
+    for command, numbers in path_commands(path_definition):
+        upper = command.upper()
+        dx, dy = (x, y) if command != upper else (0, 0)
+
+        if upper == "Z":
+            segments.append(("Z", []))
+            x, y = start
+            previous = None
+            continue
+
+        if upper == "H":
+            upper, points = "L", [(numbers[0] + dx, y)]
+        elif upper == "V":
+            upper, points = "L", [(x, numbers[0] + dy)]
+        else:
+            points = [
+                (numbers[i] + dx, numbers[i + 1] + dy)
+                for i in range(0, len(numbers), 2)
+            ]
+
+        if upper in "ST":
+            # the first control point reflects the previous one
+            kind = "C" if upper == "S" else "Q"
+            control = (x, y)
+            if previous is not None and previous[0] == kind:
+                control = (2 * x - previous[1][0], 2 * y - previous[1][1])
+            upper, points = kind, [control] + points
+
+        if upper == "M":
+            start = points[0]
+        previous = (upper, points[-2]) if upper in "CQ" else None
+        x, y = points[-1]
+        segments.append((upper, points))
+
+    return segments
+
+
+def format_number(number, decimals):
+    # number is in units of 10 ** -decimals, written without redundant zeros
+    if decimals == 0 or number == 0:
+        return str(number)
+
+    digits = str(abs(number)).rjust(decimals + 1, "0")
+    integer, fraction = digits[:-decimals], digits[-decimals:].rstrip("0")
+    if integer == "0" and fraction:
+        integer = ""
+    fraction = f".{fraction}" if fraction else ""
+    return f"{'-' if number < 0 else ''}{integer}{fraction}"
+
+
+def join_tokens(tokens):
+    out = []
+    previous = None
+    for token in tokens:
+        # a sign or a second decimal point already separates two numbers
+        if previous is not None and not previous.isalpha() and not token.isalpha():
+            if not token.startswith("-") and not (
+                token.startswith(".") and "." in previous
+            ):
+                out.append(" ")
+        out.append(token)
+        previous = token
+    return "".join(out)
+
+
+def quantize_path(path_definition, decimals):
+    return quantize_segments(absolute_segments(path_definition), decimals)
+
+
+def quantize_segments(segments, decimals):
+    # coordinates snap to a 10 ** -decimals grid in absolute space and are
+    # written as relative moves between grid points so errors do not accumulate
+    step = 10**-decimals
+    tokens = []
+    x, y = 0, 0
+    start = (0, 0)
+    previous = None
+    last_command = None
+
+    for command, points in segments:
+        grid = [(round(px / step), round(py / step)) for px, py in points]
+
+        if command == "Z":
+            letter, numbers = "z", []
+        elif command == "M":
+            letter, numbers = "m", grid
+        elif command == "L" and grid[0][1] == y:
+            letter, numbers = "h", [grid[0][0] - x]
+        elif command == "L" and grid[0][0] == x:
+            letter, numbers = "v", [grid[0][1] - y]
+        elif command == "L":
+            letter, numbers = "l", grid
+        else:
+            control = (x, y)
+            if previous is not None and previous[0] == command:
+                control = (2 * x - previous[1][0], 2 * y - previous[1][1])
+            letter, numbers = command.lower(), grid
+            if grid[0] == control:
+                letter, numbers = ("s" if command == "C" else "t"), grid[1:]
+
+        if letter in "mlcsqt":
+            numbers = [v - o for point in numbers for v, o in zip(point, (x, y))]
+
+        # the same command repeats implicitly, as do linetos after a moveto
+        implicit = letter == last_command and letter not in "mz"
+        if implicit or (letter == "l" and last_command == "m"):
+            tokens.extend(format_number(v, decimals) for v in numbers)
+        else:
+            tokens.append(letter)
+            tokens.extend(format_number(v, decimals) for v in numbers)
+
+        if letter == "z":
+            x, y = start
+            previous = None
+        else:
+            if letter == "m":
+                start = grid[0]
+            previous = (command, grid[-2]) if command in "CQ" else None
+            x, y = grid[-1]
+        last_command = letter
+
+    return join_tokens(tokens)
+
+
+def path_deviation(original, minified):
+    # control points bound Bezier curves, so the largest control point move is
+    # an upper bound on how far the outline moved
+    original = absolute_segments(original)
+    minified = absolute_segments(minified)
+    if [x[0] for x in original] != [x[0] for x in minified]:
+        raise Exception("minified path does not match the original")
+
+    deviation = 0
+    for (_, a), (_, b) in zip(original, minified):
+        for (ax, ay), (bx, by) in zip(a, b):
+            deviation = max(deviation, hypot(ax - bx, ay - by))
+    return deviation
+
+
+def path_decimals(tolerance, scale=1):
+    # rounding moves a point by at most half a grid step diagonally
+    return max(0, ceil(-log10(tolerance * sqrt(2) / scale)))
+
+
+def matrix_scale(matrix):
+    # largest singular value of the linear part of an affine matrix
+    a, b, c, d = matrix[:4]
+    s = a * a + b * b + c * c + d * d
+    return sqrt((s + sqrt(max(0, s * s - 4 * (a * d - b * c) ** 2))) / 2)
+
+
+def minify_path(path_definition, tolerance, scale=1):
+    # returns the minified path and its largest deviation in the units of the
+    # viewBox, scale being how much the path's transforms enlarge it
+    minified = quantize_path(path_definition, path_decimals(tolerance, scale))
+    deviation = path_deviation(path_definition, minified) * scale
+    if deviation > tolerance:
+        raise Exception(f"minified path deviates by {deviation}")
+    return minified, deviation
+
+
+def print_savings(records):
+    bytes_full = sum(x["counters"]["bytes_full"] for x in records)
+    bytes_out = sum(x["counters"]["bytes_out"] for x in records)
+    deviation = max(x["counters"]["max_deviation"] for x in records)
+    print(
+        f"Minified {bytes_full} to {bytes_out} bytes "
+        f"({1 - bytes_out / bytes_full:.1%} saved), largest deviation {deviation:.4f}"
+    )
+
+
+def parse_tolerance(arguments, default):
+    # --tolerance=VALUE and --no-minify of the scripts that minify paths
+    tolerance = default
+    for argument in arguments:
+        if argument.startswith("--tolerance="):
+            tolerance = float(argument.split("=")[1])
+        elif argument == "--no-minify":
+            tolerance = None
+    return tolerance
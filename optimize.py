@@ -1,278 +1,863 @@
+import hashlib
 import json
-from functools import partial
-from itertools import product
-
-from math import ceil
-from multiprocessing import Pool
+import sys
+import time
+import xml.parsers.expat
+from functools import lru_cache, partial
+from math import cos, radians, sin, tan
+from multiprocessing import Pool, cpu_count
 from optparse import Values
-from xml.dom import minidom, NotFoundErr, Node
 from os import walk, path
-from scour import scour
-from svgelements import Path
-from decimal import Decimal
+import lazy
+import metrics
+import minify
+import positions
+import regions
 
 svg_dir = path.join(path.dirname(path.realpath(__file__)), "svg")
 output_dir = path.join(path.dirname(path.realpath(__file__)), "output")
+np = lazy.LazyModule("numpy")
+identity = (1, 0, 0, 1, 0, 0)
+# largest distance in viewBox units a path may move when its coordinates are
+# rounded, None keeps scour's precision
+minify_tolerance = 0.01
+# the surah table of a pool worker, set once by init_worker
+worker_surahs = None
+# pages are handed to workers in about this many chunks each
+chunks_per_process = 4
+checkpoint_seconds = 30
+
+
+def write_data(text, attr=False):
+    # escape text the same way as xml.dom.minidom so output matches toxml()
+    text = text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    if attr:
+        text = text.replace('"', "&quot;").replace("\r", "&#13;")
+        text = text.replace("\n", "&#10;").replace("\t", "&#9;")
+    return text
+
+
+def is_namespace_declaration(name):
+    return name == "xmlns" or name.startswith("xmlns:")
+
+
+def pair_attributes(attributes):
+    # expat reports [name, value, ...], minidom puts namespace declarations first
+    pairs = list(zip(attributes[0::2], attributes[1::2]))
+    return [x for x in pairs if is_namespace_declaration(x[0])] + [
+        x for x in pairs if not is_namespace_declaration(x[0])
+    ]
 
 
-def is_path(node):
-    return (
-        node.nodeType == Node.ELEMENT_NODE
-        and node.tagName == "path"
-        and node.hasAttribute("d")
-    )
+def set_attribute(attributes, name, value):
+    for i, (key, _) in enumerate(attributes):
+        if key == name:
+            attributes[i] = (name, value)
+            return
+    attributes.append((name, value))
 
 
-def is_group(node):
-    return node.nodeType == Node.ELEMENT_NODE and node.tagName == "g"
+def remove_attribute(attributes, name):
+    attributes[:] = [x for x in attributes if x[0] != name]
 
 
-def remove_tags(tag_names, doc):
-    for tag_name in tag_names:
-        elements = doc.getElementsByTagName(tag_name)
-        for element in elements:
-            parent = element.parentNode
-            parent.removeChild(element)
+def get_attribute(attributes, name):
+    return dict(attributes).get(name, "")
 
 
-def remove_nodes(nodes):
-    for node in nodes:
-        parent = node.parentNode
-        parent.removeChild(node)
+def create_parser(start, end, text, comment):
+    parser = xml.parsers.expat.ParserCreate()
+    parser.ordered_attributes = True
+    parser.buffer_text = True
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = text
+    parser.CommentHandler = comment
+    return parser
+
+
+class XMLWriter:
+    # serializes parser events byte for byte like minidom's toxml()
+
+    def __init__(self):
+        self.chunks = ['<?xml version="1.0" ?>']
+        self.pending = None
+
+    def start_tag(self):
+        name, attributes = self.pending
+        self.pending = None
+        attrs = "".join(f' {k}="{write_data(v, True)}"' for k, v in attributes)
+        return f"<{name}{attrs}"
+
+    def flush(self):
+        if self.pending is not None:
+            self.chunks.append(self.start_tag() + ">")
 
+    def start(self, name, attributes):
+        # the tag stays open until we know whether the element has children
+        self.flush()
+        self.pending = (name, attributes)
 
-def move_node(node, new_parent):
-    moving_node = node.parentNode.removeChild(node)
-    new_parent.appendChild(moving_node)
+    def end(self, name):
+        if self.pending is not None:
+            self.chunks.append(self.start_tag() + "/>")
+        else:
+            self.chunks.append(f"</{name}>")
 
+    def text(self, data):
+        self.flush()
+        self.chunks.append(write_data(data))
 
-def adjust_root_transform(node, page_number):
-    horizontal_offset = "-115" if page_number % 2 == 0 else "-55"
-    node.setAttribute(
-        "transform", f"matrix(1.3333333,0,0,-1.3333333,{horizontal_offset},640)"
+    def comment(self, data):
+        self.flush()
+        self.chunks.append(f"<!--{data}-->")
+
+    def getvalue(self):
+        return "".join(self.chunks)
+
+
+def count_children(filepath):
+    # number of child nodes of every element, in document order
+    counts = []
+    stack = []
+    previous_text = False
+
+    def add_child():
+        if len(stack) > 0:
+            counts[stack[-1]] += 1
+
+    def start(name, attributes):
+        nonlocal previous_text
+        add_child()
+        stack.append(len(counts))
+        counts.append(0)
+        previous_text = False
+
+    def end(name):
+        nonlocal previous_text
+        stack.pop()
+        previous_text = False
+
+    def text(data):
+        nonlocal previous_text
+        # adjacent character data is merged into a single text node
+        if not previous_text:
+            add_child()
+        previous_text = True
+
+    def comment(data):
+        nonlocal previous_text
+        add_child()
+        previous_text = False
+
+    with open(filepath, "rb") as fp:
+        create_parser(start, end, text, comment).ParseFile(fp)
+
+    return counts
+
+
+def classify_child(parent, position, opening):
+    # returns the (role, removed) of a parent's child node
+    count = parent["count"]
+
+    if parent["role"] == "root":
+        if position == count - 1:
+            return "content", False
+        if opening:
+            if position == count - 2:
+                return "ayah_markers", False
+            # remove decorations
+            return None, position in range(count)[0:-2]
+        if position == 2:
+            return "ayah_markers", False
+        # remove decorations
+        decorative = range(count)[0:2], range(count)[3:-1]
+        return None, any(position in x for x in decorative)
+
+    if parent["role"] == "content":
+        if opening:
+            return ("title" if position == 0 else None), False
+        # remove decorations
+        return None, position in range(count)[0:-1]
+
+    if parent["role"] == "title" and opening:
+        # remove nested surah title
+        if position == 0:
+            return "title_group", False
+
+    if parent["role"] == "title_group":
+        return None, position == count - 1
+
+    return None, False
+
+
+def page_size(opening):
+    return (235, 235) if opening else (345, 550)
+
+
+def strip_page(filepath, page_number, opening, child_counts):
+    writer = XMLWriter()
+    frames = []
+    candidates = []
+    element_index = 0
+    previous_text = False
+
+    def add_child():
+        # returns the position of a new child node within the current element
+        parent = frames[-1]
+        parent["children"] += 1
+        return parent["children"] - 1
+
+    def start(name, attributes):
+        nonlocal element_index, previous_text
+        previous_text = False
+        attributes = pair_attributes(attributes)
+        frame = {
+            "name": name,
+            "count": child_counts[element_index],
+            "children": 0,
+            "first_path": None,
+            "role": None,
+            "removed": False,
+            "hidden": False,
+            "scan": False,
+        }
+        element_index += 1
+
+        if len(frames) == 0:
+            frame["role"] = "svg"
+            width, height = page_size(opening)
+            set_attribute(attributes, "width", f"{width}")
+            set_attribute(attributes, "height", f"{height}")
+            set_attribute(attributes, "viewBox", f"0 0 {width} {height}")
+            set_attribute(attributes, "xmlns:ayah", "https://quranapp.com")
+        else:
+            parent = frames[-1]
+            position = add_child()
+            if position == 0 and name == "path" and get_attribute(attributes, "d"):
+                parent["first_path"] = get_attribute(attributes, "d")
+
+            if parent["role"] == "svg" and name == "g" and not parent.get("root"):
+                parent["root"] = True
+                frame["role"] = "root"
+                if opening:
+                    transform = "matrix(1.3333333,0,0,-1.3333333,-136,482)"
+                else:
+                    horizontal_offset = "-115" if page_number % 2 == 0 else "-55"
+                    transform = (
+                        f"matrix(1.3333333,0,0,-1.3333333,{horizontal_offset},640)"
+                    )
+                set_attribute(attributes, "transform", transform)
+            else:
+                frame["role"], removed = classify_child(parent, position, opening)
+                if removed:
+                    frame["removed"] = True
+                    frame["scan"] = True
+
+            if frame["role"] in ["content", "ayah_markers"]:
+                set_attribute(attributes, "id", frame["role"])
+
+            # decorations are searched for surah headers before being removed
+            if parent["scan"] and parent["name"] == "g":
+                frame["scan"] = True
+
+            # remove missed white background elements
+            in_root_group = len(frames) > 1 and frames[1]["role"] == "root"
+            style = get_attribute(attributes, "style")
+            if in_root_group and name == "path" and "fill:#ffffff" in style:
+                frame["removed"] = True
+
+            if parent["removed"] or parent["hidden"]:
+                frame["hidden"] = True
+
+        parent_matrix = frames[-1]["matrix"] if len(frames) > 0 else identity
+        transform = parse_transform(get_attribute(attributes, "transform"))
+        frame["matrix"] = multiply(parent_matrix, transform)
+
+        if frame["scan"] and name == "path" and get_attribute(attributes, "d"):
+            parent = frames[-1]
+            offset = (parent["first_path"], parent["matrix"])
+            candidates.append((get_attribute(attributes, "d"), offset))
+
+        # remove all clip-path attributes
+        remove_attribute(attributes, "clip-path")
+
+        frames.append(frame)
+        if not frame["removed"] and not frame["hidden"]:
+            writer.start(name, attributes)
+
+    def end(name):
+        nonlocal previous_text
+        previous_text = False
+        frame = frames.pop()
+        if not frame["removed"] and not frame["hidden"]:
+            writer.end(name)
+
+    def visible_child():
+        parent = frames[-1]
+        _, removed = classify_child(parent, add_child(), opening)
+        return not (removed or parent["removed"] or parent["hidden"])
+
+    def text(data):
+        nonlocal previous_text
+        if len(frames) == 0:
+            return
+        if not previous_text:
+            frames[-1]["text_visible"] = visible_child()
+        previous_text = True
+        if frames[-1]["text_visible"]:
+            writer.text(data)
+
+    def comment(data):
+        nonlocal previous_text
+        previous_text = False
+        if len(frames) > 0 and visible_child():
+            writer.comment(data)
+
+    with open(filepath, "rb") as fp:
+        create_parser(start, end, text, comment).ParseFile(fp)
+
+    return writer.getvalue(), candidates
+
+
+def estimate_path_size(path_definition):
+    # returns the size of the control point hull, which contains the path, and
+    # of the segment end points, which lie on it, without evaluating any curve
+    tokens = minify.path_token.findall(path_definition)
+    commands = [(i, command) for i, (command, _) in enumerate(tokens) if command != ""]
+    numbers = np.array([float(x) if x else 0 for _, x in tokens])
+
+    current = 0j
+    start = 0j
+    hull = []
+    ends = []
+    for k, (index, command) in enumerate(commands):
+        end_index = commands[k + 1][0] if k + 1 < len(commands) else len(tokens)
+        values = numbers[index + 1 : end_index]
+        relative = command.islower()
+        command = command.upper()
+
+        if command == "Z":
+            current = start
+            continue
+        if command in ["H", "V"]:
+            if relative:
+                values = np.cumsum(values) + (
+                    current.real if command == "H" else current.imag
+                )
+            if command == "H":
+                points = values + 1j * current.imag
+            else:
+                points = current.real + 1j * values
+        elif command in ["M", "L"]:
+            points = values[0::2] + 1j * values[1::2]
+            if relative:
+                points = np.cumsum(points) + current
+        elif command == "C":
+            points = (values[0::2] + 1j * values[1::2]).reshape(-1, 3)
+            if relative:
+                segment_starts = np.cumsum(points[:, 2]) - points[:, 2] + current
+                points = points + segment_starts[:, None]
+            hull.append(points[:, :2].ravel())
+            points = points[:, 2]
+        else:
+            # smooth curves and arcs reach outside their listed points
+            return None
+
+        if command == "M":
+            start = points[0]
+        current = points[-1]
+        ends.append(points)
+
+    ends = np.concatenate(ends)
+    hull = np.concatenate(hull + [ends])
+
+    def size(points):
+        return np.ptp(points.real), np.ptp(points.imag)
+
+    return size(hull), size(ends)
+
+
+def may_be_surah_header(path_definition):
+    estimate = estimate_path_size(path_definition)
+    if estimate is None:
+        return True
+
+    # the exact size lies between the two estimates
+    (outer_width, outer_height), (inner_width, inner_height) = estimate
+    return (
+        outer_width > 244.5 - 1e-6
+        and outer_height > 24.5 - 1e-6
+        and inner_width < 249.5 + 1e-6
+        and inner_height < 29.5 + 1e-6
     )
 
 
-def set_viewbox(node, width, height):
-    node.setAttribute("width", f"{width}")
-    node.setAttribute("height", f"{height}")
-    node.setAttribute("viewBox", f"0 0 {width} {height}")
+def get_surah_header_positions(candidates):
+    from svgelements import Path
 
+    found = []
+    for path_definition, (first_path, matrix) in candidates:
+        # cheap estimate first, exact curve bounds only for the few paths left
+        if not may_be_surah_header(path_definition):
+            continue
 
-def optimize_opening_page(doc):
-    set_viewbox(doc.firstChild, 235, 235)
+        xmin, ymin, xmax, ymax = Path(path_definition).bbox()
+        width, height = xmax - xmin, ymax - ymin
+        if round(width) in range(245, 250) and round(height) in range(25, 30):
+            x, y = get_offset(first_path, matrix)
+            found.append((x, y))
 
-    root_group = [x for x in doc.firstChild.childNodes if x.tagName == "g"][0]
-    root_group.setAttribute("transform", "matrix(1.3333333,0,0,-1.3333333,-136,482)")
+    return found
 
-    root_children = root_group.childNodes
 
-    content_group = root_children[-1]
-    content_group.setAttribute("id", "content")
-    ayah_marker_group = root_children[-2]
-    ayah_marker_group.setAttribute("id", "ayah_markers")
+def set_ayah_numbers(in_string):
+    writer = XMLWriter()
+    frames = []
+    markers = []
+    found_markers = False
+
+    def number_marker():
+        # attributes are added once the marker's first child is known
+        frame = frames[-1]
+        if frame.get("marker"):
+            frame["marker"] = False
+            x, y = get_offset(frame["first_path"], frame["matrix"])
+            x, y = f"{x:.2f}", f"{y:.2f}"
+            frame["attributes"].append(("ayah:x", x))
+            frame["attributes"].append(("ayah:y", y))
+            markers.append((float(x), float(y)))
+
+    def start(name, attributes):
+        nonlocal found_markers
+        attributes = pair_attributes(attributes)
+        frame = {"first_path": None, "children": 0, "attributes": attributes}
+
+        if len(frames) == 0:
+            set_attribute(attributes, "xmlns:ayah", "https://quranapp.com/svg")
+        else:
+            parent = frames[-1]
+            parent["children"] += 1
+            if parent["children"] == 1 and name == "path":
+                parent["first_path"] = get_attribute(attributes, "d") or None
+            number_marker()
+            frame["marker"] = parent.get("ayah_markers", False)
+
+        if not found_markers and get_attribute(attributes, "id") == "ayah_markers":
+            found_markers = True
+            frame["ayah_markers"] = True
+
+        parent_matrix = frames[-1]["matrix"] if len(frames) > 0 else identity
+        transform = parse_transform(get_attribute(attributes, "transform"))
+        frame["matrix"] = multiply(parent_matrix, transform)
+        frames.append(frame)
+        writer.start(name, attributes)
+
+    def end(name):
+        number_marker()
+        frames.pop()
+        writer.end(name)
+
+    def text(data):
+        if len(frames) > 0:
+            frames[-1]["children"] += 1
+            number_marker()
+        writer.text(data)
+
+    def comment(data):
+        if len(frames) > 0:
+            frames[-1]["children"] += 1
+            number_marker()
+        writer.comment(data)
+
+    create_parser(start, end, text, comment).Parse(in_string.encode("utf-8"), True)
+
+    return writer.getvalue(), markers
+
+
+def minify_paths(in_string, tolerance):
+    # quantizes every path to the tolerance in viewBox units, taking the scale
+    # of its transforms into account
+    writer = XMLWriter()
+    matrices = [identity]
+    deviation = 0
+
+    def start(name, attributes):
+        nonlocal deviation
+        attributes = pair_attributes(attributes)
+        transform = parse_transform(get_attribute(attributes, "transform"))
+        matrices.append(multiply(matrices[-1], transform))
+
+        path_definition = get_attribute(attributes, "d")
+        if name == "path" and path_definition:
+            scale = minify.matrix_scale(matrices[-1])
+            minified, path_deviation = minify.minify_path(
+                path_definition, tolerance, scale
+            )
+            set_attribute(attributes, "d", minified)
+            deviation = max(deviation, path_deviation)
+        writer.start(name, attributes)
+
+    def end(name):
+        matrices.pop()
+        writer.end(name)
+
+    create_parser(start, end, writer.text, writer.comment).Parse(
+        in_string.encode("utf-8"), True
+    )
 
-    # remove decorations
-    decorative_nodes = root_children[0:-2]
-    remove_nodes(decorative_nodes)
+    return writer.getvalue(), deviation
 
-    # remove nested surah title
-    remove_nodes([content_group.firstChild.firstChild.lastChild])
 
+def multiply(m, n):
+    # composes two affine matrices (a, b, c, d, e, f), applying n first
+    return (
+        m[0] * n[0] + m[2] * n[1],
+        m[1] * n[0] + m[3] * n[1],
+        m[0] * n[2] + m[2] * n[3],
+        m[1] * n[2] + m[3] * n[3],
+        m[0] * n[4] + m[2] * n[5] + m[4],
+        m[1] * n[4] + m[3] * n[5] + m[5],
+    )
 
-def optimize_standard_page(doc, page_number, surahs):
-    set_viewbox(doc.firstChild, 345, 550)
 
-    root_group = [x for x in doc.firstChild.childNodes if x.tagName == "g"][0]
-    adjust_root_transform(root_group, page_number)
+@lru_cache(maxsize=None)
+def parse_transform(transform_definition):
+    from scour import scour
+
+    matrix = identity
+    for tr, vals in scour.svg_transform_parser.parse(transform_definition):
+        vals = [float(x) for x in vals]
+        if tr == "matrix":
+            transform = tuple(vals)
+        elif tr == "translate":
+            transform = (1, 0, 0, 1, vals[0], vals[1] if len(vals) > 1 else 0)
+        elif tr == "scale":
+            transform = (vals[0], 0, 0, vals[-1], 0, 0)
+        elif tr == "rotate":
+            angle = radians(vals[0])
+            transform = (cos(angle), sin(angle), -sin(angle), cos(angle), 0, 0)
+            if len(vals) == 3:
+                cx, cy = vals[1], vals[2]
+                transform = multiply((1, 0, 0, 1, cx, cy), transform)
+                transform = multiply(transform, (1, 0, 0, 1, -cx, -cy))
+        elif tr == "skewX":
+            transform = (1, 0, tan(radians(vals[0])), 1, 0, 0)
+        elif tr == "skewY":
+            transform = (1, tan(radians(vals[0])), 0, 1, 0, 0)
+        else:
+            raise Exception(f"unsupported transform {tr}")
+        matrix = multiply(matrix, transform)
+
+    return matrix
+
+
+def get_offset(first_path, matrix):
+    from svgelements import Path
+
+    x, y = 0, 0
+    if first_path is not None:
+        xmin, ymin, xmax, ymax = Path(first_path).bbox()
+        # use path's bounding box to get the center of the ayah marker
+        x, y = xmin + ((xmax - xmin) / 2), ymin + ((ymax - ymin) / 2)
 
-    root_children = root_group.childNodes
+    # matrix is the node's transform composed with those of all its ancestors
+    return (
+        matrix[0] * x + matrix[2] * y + matrix[4],
+        matrix[1] * x + matrix[3] * y + matrix[5],
+    )
 
-    content_group = root_children[-1]
-    content_group.setAttribute("id", "content")
-    ayah_marker_group = root_children[2]
-    ayah_marker_group.setAttribute("id", "ayah_markers")
 
-    content_children = content_group.childNodes
-    decorative_nodes = root_children[0:2] + root_children[3:-1] + content_children[0:-1]
+def scour_xml(in_string):
+    # scour and svgelements are imported where they are used so runs that
+    # rebuild no pages, and the modules importing this one, start quickly
+    from scour import scour
 
-    # figure out surah header position
-    page_surahs = [x for x in surahs if x["pageNumber"] == page_number]
-    if len(page_surahs) > 0:
-        found = get_surah_header_positions(decorative_nodes)
+    options = scour.sanitizeOptions(
+        Values(
+            {
+                "remove_descriptive_elements": True,
+                "enable_viewboxing": True,
+                "strip_ids": True,
+                "protect_ids_list": "ayah_markers,content",
+            }
+        )
+    )
+
+    # scour the string
+    return scour.scourString(in_string, options)
 
-        if len(found) != len(page_surahs):
+
+def page_surahs(found, surahs, page_number):
+    # figure out surah header position
+    out = [x for x in surahs if x["pageNumber"] == page_number]
+    if len(out) > 0:
+        if len(found) != len(out):
             raise Exception("surah header count mismatch")
 
         found_sorted = sorted(found, key=lambda pair: pair[1])
-        for i in range(len(page_surahs)):
-            s = page_surahs[i]
-            f = found_sorted[i]
-            s["headerPosition"] = float(round(f[1], 2))
+        for i in range(len(out)):
+            out[i]["headerPosition"] = float(round(found_sorted[i][1], 2))
 
-    # remove missed white background elements
-    bad_paths = [
-        x
-        for x in root_group.getElementsByTagName("path")
-        if "fill:#ffffff" in x.getAttribute("style")
-    ]
+    return out
 
-    # remove decorations
-    remove_nodes(decorative_nodes + bad_paths)
 
-    return page_surahs
+def write_page(filename, out_string):
+    with open(path.join(output_dir, filename), "w") as file:
+        file.write(out_string)
 
 
-def get_surah_header_positions(nodes):
-    found = []
-    for node in nodes:
-        if is_group(node):
-            found.extend(get_surah_header_positions(node.childNodes))
-        if is_path(node):
-            path_definition = node.getAttribute("d")
-            xmin, ymin, xmax, ymax = Path(path_definition).bbox()
-            width, height = xmax - xmin, ymax - ymin
-            if round(width) in range(245, 250) and round(height) in range(25, 30):
-                x, y = get_offset(node.parentNode)
-                found.append((x, y))
+def build_page(filename, surahs, page_metrics, tolerance):
+    filepath = path.join(svg_dir, filename)
+    page_number = int(path.splitext(filename)[0])
+    opening = filename in ["001.svg", "002.svg"]
+
+    # the page is streamed instead of loaded into a DOM to keep workers small
+    with metrics.stage(page_metrics, "parse"):
+        child_counts = count_children(filepath)
+    with metrics.stage(page_metrics, "strip"):
+        in_string, candidates = strip_page(filepath, page_number, opening, child_counts)
+    out = None
+    found = None
+    if not opening:
+        # headers are searched for on every page, not only where surah.json
+        # starts a surah, so validate.py can check the table against them
+        with metrics.stage(page_metrics, "headers"):
+            found = get_surah_header_positions(candidates)
+            out = page_surahs(found, surahs, page_number)
+    with metrics.stage(page_metrics, "scour"):
+        scoured = scour_xml(in_string)
+    with metrics.stage(page_metrics, "markers"):
+        out_string, markers = set_ayah_numbers(scoured)
+    deviation = 0
+    bytes_full = len(out_string.encode())
+    if tolerance is not None:
+        with metrics.stage(page_metrics, "minify"):
+            out_string, deviation = minify_paths(out_string, tolerance)
+    with metrics.stage(page_metrics, "write"):
+        write_page(filename, out_string)
+
+    metrics.count(
+        page_metrics,
+        bytes_in=path.getsize(filepath),
+        bytes_full=bytes_full,
+        bytes_out=len(out_string.encode()),
+        max_deviation=deviation,
+        header_candidates=len(candidates),
+        headers=len(found or []),
+        markers=len(markers),
+    )
 
-    return found
+    # markers are returned in reading order so positions can be written without
+    # reading the page back
+    _, page_height = page_size(opening)
+    markers = positions.sort_markers(markers, page_number, page_height)
 
+    headers = None if found is None else len(found)
+    return {"surahs": out, "headers": headers, "markers": markers}
 
-def set_ayah_numbers(doc):
-    ayah_marker_group = doc.getElementById("ayah_markers")
-    ayah_markers = ayah_marker_group.childNodes
 
-    for node in ayah_markers:
-        # print ayah offset
-        x, y = get_offset(node)
+def load_surahs():
+    surahs_file = path.join(path.dirname(path.realpath(__file__)), "surah.json")
+    with open(surahs_file) as fp:
+        return json.load(fp)
 
-        node.setAttribute("ayah:x", str(round(x, 2)))
-        node.setAttribute("ayah:y", str(round(y, 2)))
 
+def init_worker(surahs):
+    # pool workers keep the surah table so tasks only carry a filename
+    global worker_surahs
+    worker_surahs = surahs
 
-def get_offset(node, x=0, y=0):
-    if node.firstChild is not None and is_path(node.firstChild):
-        path_definition = node.firstChild.getAttribute("d")
-        xmin, ymin, xmax, ymax = Path(path_definition).bbox()
-        # use path's bounding box to get the center of the ayah marker
-        x += Decimal(xmin + ((xmax - xmin) / 2))
-        y += Decimal(ymin + ((ymax - ymin) / 2))
 
-    try:
-        transform = scour.svg_transform_parser.parse(node.getAttribute("transform"))
-        while len(transform) > 0:
-            tr, vals = transform.pop()
-            if tr == "translate":
-                x += vals[0]
-                y += vals[1]
-            if tr == "matrix":
-                x = vals[0] * x + vals[2] * y + vals[4]
-                y = vals[1] * y + vals[3] * y + vals[5]
-    except NotFoundErr:
-        pass
-    except AttributeError:
-        pass
-
-    if node.parentNode is not None:
-        return get_offset(node.parentNode, x, y)
-
-    return x, y
-
-
-def scour_xml(doc):
-    in_string = doc.toxml()
-    doc.unlink()
+def process_file(filename, surahs=None, profile_dir=None, tolerance=minify_tolerance):
+    surahs = worker_surahs if surahs is None else surahs
+    page_number = int(path.splitext(filename)[0])
+    page_metrics = metrics.new_metrics("optimize", page_number)
 
-    options = scour.sanitizeOptions(
-        Values(
-            {
-                "remove_descriptive_elements": True,
-                "enable_viewboxing": True,
-                "strip_ids": True,
-                "protect_ids_list": "ayah_markers,content",
-            }
-        )
-    )
+    with metrics.profiled(metrics.profile_file(profile_dir, "optimize", page_number)):
+        result = build_page(filename, surahs, page_metrics, tolerance)
 
-    # scour the string
-    out_string = scour.scourString(in_string, options)
+    return dict(result, metrics=page_metrics)
 
-    # prepare the output xml.dom.minidom object
-    doc = minidom.parseString(out_string.encode("utf-8"))
 
-    # since minidom does not seem to parse DTDs properly
-    # manually declare all attributes with name "id" to be of type ID
-    # (otherwise things like doc.getElementById() won't work)
-    all_nodes = doc.getElementsByTagName("*")
-    for node in all_nodes:
-        try:
-            node.setIdAttribute("id")
-        except NotFoundErr:
-            pass
+def hash_bytes(*chunks):
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()
 
-    return doc
 
+def code_version(tolerance):
+    from scour import __version__ as scour_version
 
-def process_file(filename, surahs):
-    print(f"Opening {filename}")
+    # any change to the build modules or to scour invalidates every cached page
+    sources = []
+    for module_file in [__file__, minify.__file__, positions.__file__]:
+        with open(path.realpath(module_file), "rb") as fp:
+            sources.append(fp.read())
+    settings = f"{scour_version} {tolerance}"
+    return hash_bytes(*sources, settings.encode("utf-8"))
 
-    filepath = path.join(svg_dir, filename)
+
+def page_key(filename, surahs, version):
     page_number = int(path.splitext(filename)[0])
+    page_surahs = [x for x in surahs if x["pageNumber"] == page_number]
 
-    doc = minidom.parse(filepath)
+    with open(path.join(svg_dir, filename), "rb") as fp:
+        source = fp.read()
 
-    if filename in ["001.svg", "002.svg"]:
-        optimize_opening_page(doc)
-        out = None
-    else:
-        out = optimize_standard_page(doc, page_number, surahs)
+    return hash_bytes(
+        source,
+        version.encode("utf-8"),
+        json.dumps(page_surahs, sort_keys=True).encode("utf-8"),
+    )
 
-    doc.firstChild.setAttribute("xmlns:ayah", "https://quranapp.com")
 
-    # remove all clip-path attributes
-    all_nodes = doc.getElementsByTagName("*")
-    for node in all_nodes:
-        try:
-            node.removeAttribute("clip-path")
-        except NotFoundErr:
-            pass
+def load_manifest():
+    manifest_file = path.join(output_dir, "manifest.json")
+    if not path.exists(manifest_file):
+        return {}
 
-    doc = scour_xml(doc)
-    doc.firstChild.setAttribute("xmlns:ayah", "https://quranapp.com/svg")
+    with open(manifest_file) as fp:
+        return json.load(fp)
 
-    set_ayah_numbers(doc)
 
-    out_string = doc.toxml()
-    doc.unlink()
+def save_manifest(manifest):
+    with open(path.join(output_dir, "manifest.json"), "w") as fp:
+        json.dump(manifest, fp, indent=4, sort_keys=True)
 
-    with open(path.join(output_dir, filename), "w") as file:
-        file.write(out_string)
-        print(f"Processed {filename}")
 
-    return out
+def process_chunk(filenames, profile_dir=None, tolerance=minify_tolerance):
+    # a failing page is returned with its error instead of aborting the batch
+    results = []
+    for filename in filenames:
+        try:
+            result = process_file(filename, None, profile_dir, tolerance)
+            results.append((filename, result))
+        except Exception as e:
+            results.append((filename, {"error": f"{type(e).__name__}: {e}"}))
+    return results
+
+
+def pool_processes(pool):
+    # the size a pool was started with, build.py can start the shared pool with
+    # fewer processes than there are CPUs and Pool keeps its size private
+    return getattr(pool, "_processes", None) or cpu_count()
+
+
+def page_chunks(files, processes):
+    # scour dominates and scales with the size of the source, so the largest
+    # pages are handed out first and alone while small ones are batched up to
+    # a share of the work that leaves every worker a few chunks
+    costs = {x: path.getsize(path.join(svg_dir, x)) for x in files}
+    share = sum(costs.values()) / (processes * chunks_per_process)
+    chunks = []
+    chunk_cost = 0
+    for filename in sorted(files, key=lambda x: -costs[x]):
+        if len(chunks) > 0 and chunk_cost + costs[filename] <= share:
+            chunks[-1].append(filename)
+            chunk_cost += costs[filename]
+        else:
+            chunks.append([filename])
+            chunk_cost = costs[filename]
+    return chunks
+
+
+def build_pages(stale, keys, manifest, pool, profile_dir, tolerance):
+    # results are merged into the manifest as they arrive and the manifest is
+    # saved every few seconds, so an interrupted run resumes where it stopped
+    records = []
+    failures = {}
+    # the tolerance goes with every task, workers started by spawn would only
+    # see the module default
+    task = partial(process_chunk, profile_dir=profile_dir, tolerance=tolerance)
+    chunks = page_chunks(stale, pool_processes(pool))
+    last_checkpoint = time.time()
+    try:
+        for results in pool.imap_unordered(task, chunks):
+            for filename, result in results:
+                if "error" in result:
+                    failures[filename] = result["error"]
+                    manifest.pop(filename, None)
+                    continue
 
+                records.append(result.pop("metrics"))
+                manifest[filename] = dict(result, key=keys[filename])
 
-def optimize_svgs():
-    surahs_file = path.join(path.dirname(path.realpath(__file__)), "surah.json")
-    with open(surahs_file) as fp:
-        surahs = json.load(fp)
+            if time.time() - last_checkpoint > checkpoint_seconds:
+                save_manifest(manifest)
+                last_checkpoint = time.time()
+    finally:
+        save_manifest(manifest)
+
+    return records, failures
+
+
+def optimize_svgs(force=False, profile=False, pool=None, tolerance=minify_tolerance):
+    # pool, if given, must have been started with init_worker and the surahs
+    surahs = load_surahs()
 
     files = []
     for (_, _, filenames) in walk(svg_dir):
         svg_files = [file for file in filenames if file[-4:] == ".svg"]
         files.extend(svg_files)
-
-    with Pool() as p:
-        updated_surahs = p.map(partial(process_file, surahs=surahs), files)
-
-    for page_surahs in [x for x in updated_surahs if x is not None]:
-        for surah in page_surahs:
+    files.sort()
+
+    # skip pages whose source, surah entries and build code are unchanged
+    manifest = {} if force else load_manifest()
+    manifest = {x: manifest[x] for x in files if x in manifest}
+    version = code_version(tolerance)
+    keys = {x: page_key(x, surahs, version) for x in files}
+    stale = [
+        x
+        for x in files
+        if manifest.get(x, {}).get("key") != keys[x]
+        or not path.exists(path.join(output_dir, x))
+    ]
+    print(f"Rebuilding {len(stale)} of {len(files)} pages")
+
+    failures = {}
+    if len(stale) > 0:
+        profile_dir = path.join(output_dir, "profile") if profile else None
+        build = partial(build_pages, stale, keys, manifest)
+        if pool is None:
+            with Pool(initializer=init_worker, initargs=(surahs,)) as p:
+                records, failures = build(p, profile_dir, tolerance)
+        else:
+            records, failures = build(pool, profile_dir, tolerance)
+
+        metrics.write_report(records, path.join(output_dir, "optimize_metrics.jsonl"))
+        metrics.print_slowest(records)
+        if tolerance is not None and len(records) > 0:
+            minify.print_savings(records)
+
+    for filename in sorted(manifest):
+        for surah in manifest[filename]["surahs"] or []:
             surahs[surah["number"] - 1] = surah
 
     with open(path.join(output_dir, "surah.json"), "w") as fp:
         json.dump(surahs, fp, ensure_ascii=False, indent=4, sort_keys=True)
 
+    if len(failures) > 0:
+        # ayahs are numbered across pages, so positions wait for every page
+        for filename in sorted(failures):
+            print(f"  page {filename} failed: {failures[filename]}")
+        print(f"{len(failures)} pages failed, positions were not written")
+        return failures
+
+    pages = [(int(path.splitext(x)[0]), manifest[x]["markers"]) for x in files]
+    positions.write_positions(pages, surahs, output_dir)
+    regions.write_regions(
+        regions.build_regions(output_dir), path.join(output_dir, "regions.json")
+    )
+    return failures
+
 
 if __name__ == "__main__":
-    optimize_svgs()
+    failures = optimize_svgs(
+        force="--force" in sys.argv,
+        profile="--profile" in sys.argv,
+        tolerance=minify.parse_tolerance(sys.argv[1:], minify_tolerance),
+    )
+    if len(failures) > 0:
+        sys.exit(1)
@@ -0,0 +1,135 @@
+import mmap
+import struct
+import sys
+import zlib
+from os import path
+
+output_dir = path.join(path.dirname(path.realpath(__file__)), "output")
+archive_file = path.join(output_dir, "quran.pack")
+
+# layout, all integers little endian:
+#   header  magic "QSVGPACK", version u16, flags u16, rows u32, slots u32
+#   index   rows * slots entries of (offset u64, length u64), offsets are from
+#           the start of the file and a length of 0 means the file is missing
+#   data    the files back to back, each zlib compressed if flags has bit 0
+# row 0 holds corpus files, row N the files of page N, so any lookup is one
+# read at a computed position
+magic = b"QSVGPACK"
+version = 1
+compressed_flag = 1
+header = struct.Struct("<8sHHII")
+entry = struct.Struct("<QQ")
+page_count = 604
+line_count = 15
+page_slot = 0
+positions_slot = line_count + 1
+slots = line_count + 2
+corpus_files = ["markers.json", "surah.json"]
+
+
+def page_files(page):
+    # slot 0 is the page, slots 1 to 15 its lines and slot 16 its positions
+    files = [f"{page:03}.svg"]
+    files += [path.join(f"{page:03}", f"{x}.svg") for x in range(1, line_count + 1)]
+    files.append(f"{page:03}.json")
+    return files
+
+
+def pack_output(filepath=None, compress=False):
+    filepath = filepath or archive_file
+    rows = [corpus_files] + [page_files(x) for x in range(1, page_count + 1)]
+    index = []
+    offset = header.size + len(rows) * slots * entry.size
+
+    with open(filepath, "wb") as fp:
+        # the index is written once the offsets are known
+        fp.seek(offset)
+        for row in rows:
+            for slot in range(slots):
+                source = path.join(output_dir, row[slot]) if slot < len(row) else None
+                if source is None or not path.exists(source):
+                    index.append((0, 0))
+                    continue
+
+                with open(source, "rb") as source_fp:
+                    data = source_fp.read()
+                if compress:
+                    data = zlib.compress(data)
+                fp.write(data)
+                index.append((offset, len(data)))
+                offset += len(data)
+
+        fp.seek(0)
+        flags = compressed_flag if compress else 0
+        fp.write(header.pack(magic, version, flags, len(rows), slots))
+        fp.write(b"".join(entry.pack(*x) for x in index))
+
+    return offset
+
+
+class PackReader:
+    # maps an archive written by pack_output and returns its files as
+    # memoryviews into the mapping, or as bytes if the archive is compressed
+
+    def __init__(self, filepath=None):
+        self.fp = open(filepath or archive_file, "rb")
+        self.map = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        file_magic, file_version, flags, self.rows, self.slots = header.unpack_from(
+            self.map
+        )
+        if file_magic != magic or file_version != version:
+            raise Exception("not a page archive")
+        self.compressed = bool(flags & compressed_flag)
+
+    def get(self, row, slot):
+        if not 0 <= row < self.rows or not 0 <= slot < self.slots:
+            raise KeyError((row, slot))
+
+        position = header.size + (row * self.slots + slot) * entry.size
+        offset, length = entry.unpack_from(self.map, position)
+        if length == 0:
+            raise KeyError((row, slot))
+
+        data = self.view[offset : offset + length]
+        return zlib.decompress(data) if self.compressed else data
+
+    def page_entry(self, page, slot):
+        # row 0 belongs to the corpus files
+        if page < 1:
+            raise KeyError((page, slot))
+        return self.get(page, slot)
+
+    def page(self, page):
+        return self.page_entry(page, page_slot)
+
+    def line(self, page, line):
+        if not 1 <= line <= line_count:
+            raise KeyError((page, line))
+        return self.page_entry(page, line)
+
+    def positions(self, page):
+        return self.page_entry(page, positions_slot)
+
+    def corpus_file(self, filename):
+        return self.get(0, corpus_files.index(filename))
+
+    def close(self):
+        # views returned by the lookups must be released first, the mapping
+        # cannot be closed while they point into it and raises BufferError
+        try:
+            self.view.release()
+            self.map.close()
+        finally:
+            self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+if __name__ == "__main__":
+    size = pack_output(compress="--compress" in sys.argv)
+    print(f"Packed {size} bytes into {archive_file}")
@@ -1,68 +1,115 @@
 import json
+import mmap
+import struct
 from math import ceil
+from multiprocessing import Pool
 from os import path, walk
-from xml.dom import minidom, NotFoundErr, Node
-
-
-def node_sort_key(node, page_height, lines, offset):
-    x = float(node.getAttribute("ayah:x"))
-    y = float(node.getAttribute("ayah:y"))
+from xml.etree.ElementTree import XMLPullParser
+
+import lazy
+
+output_dir = path.join(path.dirname(path.realpath(__file__)), "output")
+surahs_file = path.join(path.dirname(path.realpath(__file__)), "surah.json")
+ayah_namespace = "{https://quranapp.com/svg}"
+np = lazy.LazyModule("numpy")
+
+# markers.bin layout, all little endian:
+#   header   magic "QMRK", version u16, decimals u16, pages u32, ayahs u32
+#   numbers  pages u32, the page number of each entry, a build of only some
+#            pages does not have to start at page 1
+#   offsets  pages + 1 u32, the index of each page's first ayah followed by the
+#            number of ayahs, so entry i has ayahs offsets[i] to offsets[i + 1]
+#   x, y     ayahs float32 each, in ayah order
+# positions are written with a fixed number of decimals, so rounding the
+# float32 values to them gives back the exact JSON numbers
+markers_magic = b"QMRK"
+markers_version = 2
+markers_decimals = 2
+markers_header = struct.Struct("<4sHHII")
+
+
+def node_sort_key(marker, page_height, lines, offset):
+    x, y = marker
     line_ratio = (page_height - (offset * 2)) / lines
     line_number = ceil((y - offset) / line_ratio)
     return [line_number, -x]
 
 
-def generate_positions():
-    files = list()
+def page_layout(page_number):
+    lines = 15 if page_number > 2 else 7
+    offset = 6 if page_number > 2 else 20
+    return lines, offset
 
-    output_dir = path.join(path.dirname(path.realpath(__file__)), "output")
 
-    for (_, _, filenames) in walk(output_dir):
-        files.extend([x for x in filenames if x.endswith("svg")])
+def page_files(directory):
+    # only the pages themselves, not the line directories written by line_split
+    _, _, filenames = next(walk(directory))
+    return sorted(
+        x for x in filenames if x.endswith(".svg") and path.splitext(x)[0].isdigit()
+    )
 
-    with open("surah.json") as fp:
-        surahs = json.load(fp)
 
-    surah_index = 0
-    ayah_number = 0
-    ayah_index = 0
-    marker_data = []
+def read_markers(filepath, chunk_size=65536):
+    # the markers group comes before the page content, so parsing stops as soon
+    # as it has been closed instead of reading the whole file
+    parser = XMLPullParser(events=("start", "end"))
+    page_height = None
+    markers = []
+    depth = 0
+    markers_depth = None
 
-    for filename in sorted(files):
-        filepath = path.join(output_dir, filename)
-        doc = minidom.parse(filepath)
+    with open(filepath, "rb") as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b""):
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                if event == "end":
+                    depth -= 1
+                    if depth == markers_depth:
+                        return page_height, markers
+                    continue
 
-        page_number = int(path.splitext(filename)[0])
+                if page_height is None:
+                    page_height = float(element.get("viewBox").split()[3])
+                if markers_depth is not None and depth == markers_depth + 1:
+                    x = element.get(f"{ayah_namespace}x")
+                    y = element.get(f"{ayah_namespace}y")
+                    markers.append((float(x), float(y)))
+                if markers_depth is None and element.get("id") == "ayah_markers":
+                    markers_depth = depth
+                depth += 1
 
-        # make getElementById work
-        all_nodes = doc.getElementsByTagName("*")
-        for node in all_nodes:
-            try:
-                node.setIdAttribute("id")
-            except NotFoundErr:
-                pass
+    raise Exception(f"no ayah markers found in {filepath}")
 
-        items = []
 
-        page_height = float(doc.getElementsByTagName("svg")[0].getAttribute("viewBox").split()[3])
-        lines = 15 if page_number > 2 else 7
-        offset = 6 if page_number > 2 else 20
+def sort_markers(markers, page_number, page_height):
+    lines, offset = page_layout(page_number)
+    return sorted(markers, key=lambda x: node_sort_key(x, page_height, lines, offset))
 
-        # find ayah markers
-        nodes = doc.getElementById("ayah_markers").childNodes
-        nodes = [x for x in nodes if x.nodeType == Node.ELEMENT_NODE]
-        nodes = sorted(nodes, key=lambda sort_node: node_sort_key(sort_node, page_height, lines, offset))
-        for node in nodes:
+
+def page_markers(filename):
+    page_number = int(path.splitext(filename)[0])
+    page_height, markers = read_markers(path.join(output_dir, filename))
+    return page_number, sort_markers(markers, page_number, page_height)
+
+
+def write_positions(pages, surahs, directory):
+    # pages are (page number, markers in reading order) pairs in page order
+    surah_index = 0
+    ayah_number = 0
+    ayah_index = 0
+    marker_data = []
+
+    for page_number, markers in pages:
+        items = []
+        for x, y in markers:
             ayah_number += 1
             ayah_index += 1
-            x = node.getAttribute("ayah:x")
-            y = node.getAttribute("ayah:y")
             items.append(
                 {
                     "surahNumber": surahs[surah_index]["number"],
                     "ayahNumber": ayah_number,
-                    "x": float(x),
-                    "y": float(y),
+                    "x": x,
+                    "y": y,
                 }
             )
 
@@ -70,8 +117,8 @@ def generate_positions():
                 {
                     "page": page_number,
                     "ayah": ayah_index,
-                    "x": float(x),
-                    "y": float(y),
+                    "x": x,
+                    "y": y,
                 }
             )
 
@@ -79,11 +126,83 @@ def generate_positions():
                 ayah_number = 0
                 surah_index += 1
 
-        with open(path.join(output_dir, f"{page_number:03}.json"), "w") as fp:
+        with open(path.join(directory, f"{page_number:03}.json"), "w") as fp:
             json.dump(items, fp, indent=4, sort_keys=True)
 
-        with open(path.join(output_dir, "markers.json"), "w") as fp:
-            json.dump(marker_data, fp, indent=4)
+    with open(path.join(directory, "markers.json"), "w") as fp:
+        json.dump(marker_data, fp, indent=4)
+
+    write_markers_binary(pages, path.join(directory, "markers.bin"))
+
+
+def write_markers_binary(pages, filepath):
+    numbers = np.array([x for x, _ in pages], dtype="<u4")
+    counts = [len(markers) for _, markers in pages]
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype("<u4")
+    points = np.array([x for _, markers in pages for x in markers], dtype="<f4")
+    points = points.reshape(-1, 2)
+
+    with open(filepath, "wb") as fp:
+        fp.write(
+            markers_header.pack(
+                markers_magic,
+                markers_version,
+                markers_decimals,
+                len(pages),
+                int(offsets[-1]),
+            )
+        )
+        fp.write(numbers.tobytes())
+        fp.write(offsets.tobytes())
+        fp.write(np.ascontiguousarray(points[:, 0]).tobytes())
+        fp.write(np.ascontiguousarray(points[:, 1]).tobytes())
+
+
+def read_markers_binary(filepath):
+    # returns (numbers, offsets, x, y) as arrays over a read only memory map
+    with open(filepath, "rb") as fp:
+        buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, decimals, pages, ayahs = markers_header.unpack_from(buffer)
+    if magic != markers_magic or version != markers_version:
+        raise Exception(f"{filepath} is not a markers file")
+    if decimals != markers_decimals:
+        raise Exception(f"{filepath} has positions with {decimals} decimals")
+
+    offset = markers_header.size
+    numbers = np.frombuffer(buffer, "<u4", pages, offset)
+    offset += numbers.nbytes
+    offsets = np.frombuffer(buffer, "<u4", pages + 1, offset)
+    offset += offsets.nbytes
+    x = np.frombuffer(buffer, "<f4", ayahs, offset)
+    y = np.frombuffer(buffer, "<f4", ayahs, offset + x.nbytes)
+    return numbers, offsets, x, y
+
+
+def positions_from_binary(filepath, directory):
+    # regenerates markers.json and the per-page files from markers.bin
+    with open(surahs_file) as fp:
+        surahs = json.load(fp)
+
+    numbers, offsets, x, y = read_markers_binary(filepath)
+    x = [round(float(v), markers_decimals) for v in x]
+    y = [round(float(v), markers_decimals) for v in y]
+    pages = []
+    for i, page_number in enumerate(numbers.tolist()):
+        first, last = offsets[i], offsets[i + 1]
+        pages.append((page_number, list(zip(x[first:last], y[first:last]))))
+    write_positions(pages, surahs, directory)
+
+
+def generate_positions(processes=None):
+    with open(surahs_file) as fp:
+        surahs = json.load(fp)
+
+    # pages are read in parallel, ayahs are numbered afterwards in page order
+    with Pool(processes) as p:
+        pages = p.map(page_markers, page_files(output_dir))
+
+    write_positions(pages, surahs, output_dir)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,214 @@
+import json
+import sys
+from bisect import bisect_left, bisect_right
+from os import path
+
+import lazy
+import positions
+
+output_dir = positions.output_dir
+regions_file = path.join(output_dir, "regions.json")
+np = lazy.LazyModule("numpy")
+# regions are keyed by line and x so both searches happen in one sorted array
+line_stride = 1024
+
+
+def page_size(page_number):
+    return (235, 235) if page_number < 3 else (345, 550)
+
+
+def line_bounds(page_number):
+    # the same line bands positions.node_sort_key uses to order the markers,
+    # rounded like every other coordinate in the regions
+    lines, offset = positions.page_layout(page_number)
+    _, page_height = page_size(page_number)
+    line_ratio = (page_height - (offset * 2)) / lines
+    return [round(offset + (x * line_ratio), 2) for x in range(lines + 1)]
+
+
+def line_number(y, bounds):
+    return min(max(bisect_right(bounds, y), 1), len(bounds) - 1)
+
+
+def skipped_lines(page_number, page_surahs, bounds):
+    # surah headers and the basmala under them belong to no ayah, the opening
+    # pages keep fixed header positions outside of the line layout
+    if page_number < 3:
+        return set()
+
+    lines = set()
+    for surah in page_surahs:
+        header_line = line_number(surah["headerPosition"], bounds)
+        lines.add(header_line)
+        if surah["number"] != 9:
+            lines.add(header_line + 1)
+    return lines
+
+
+def ayah_numbers(surahs):
+    # (surah, ayah) for every ayah in order, indexed like markers.bin
+    return [(x["number"], y) for x in surahs for y in range(1, x["ayahCount"] + 1)]
+
+
+def page_regions(page_number, markers, first_ayah, ayahs, page_surahs):
+    # the text of an ayah runs right to left from the previous marker to its
+    # own, so each ayah is a run of rectangles between two markers
+    width, _ = page_size(page_number)
+    bounds = line_bounds(page_number)
+    skipped = skipped_lines(page_number, page_surahs, bounds)
+    lines = [x for x in range(1, len(bounds)) if x not in skipped]
+    regions = []
+
+    def add(line, x0, x1, ayah_index):
+        if x1 > x0 and line in lines and ayah_index < len(ayahs):
+            surah, ayah = ayahs[ayah_index]
+            regions.append(
+                [x0, bounds[line - 1], x1, bounds[line], surah, ayah, ayah_index]
+            )
+
+    cursor = (lines[0], width) if len(lines) > 0 else (0, 0)
+    ends = [(line_number(y, bounds), round(x, 2)) for x, y in markers]
+    ends.append((lines[-1] if len(lines) > 0 else 0, 0))
+
+    for ayah_index, (line, x) in enumerate(ends, first_ayah):
+        if line == cursor[0]:
+            add(line, x, cursor[1], ayah_index)
+        elif line > cursor[0]:
+            # what is left of a line before a surah header is blank
+            if not skipped.intersection(range(cursor[0] + 1, line)):
+                add(cursor[0], 0, cursor[1], ayah_index)
+            for between in range(cursor[0] + 1, line):
+                add(between, 0, width, ayah_index)
+            add(line, x, width, ayah_index)
+        cursor = (line, x)
+
+    return regions
+
+
+def build_regions(directory=output_dir):
+    with open(path.join(directory, "surah.json")) as fp:
+        surahs = json.load(fp)
+
+    numbers, offsets, x, y = positions.read_markers_binary(
+        path.join(directory, "markers.bin")
+    )
+    ayahs = ayah_numbers(surahs)
+    pages = {}
+    for i, page_number in enumerate(numbers.tolist()):
+        first, last = int(offsets[i]), int(offsets[i + 1])
+        markers = list(zip(x[first:last].tolist(), y[first:last].tolist()))
+        page_surahs = [x for x in surahs if x["pageNumber"] == page_number]
+        pages[page_number] = page_regions(
+            page_number, markers, first, ayahs, page_surahs
+        )
+
+    return pages
+
+
+def write_regions(pages, filepath=regions_file):
+    with open(filepath, "w") as fp:
+        json.dump(pages, fp, separators=(",", ":"))
+
+
+class RegionIndex:
+    # answers hit tests for one page, regions are [x0, y0, x1, y1, surah, ayah,
+    # ayah index] rectangles that never overlap and each sit within one line
+
+    def __init__(self, page_number, regions):
+        self.bounds = line_bounds(page_number)
+        self.regions = sorted(regions, key=self.region_key)
+        self.keys = [self.region_key(x) for x in self.regions]
+        self.key_array = np.array(self.keys)
+        self.x1 = np.array([x[2] for x in self.regions])
+
+    def region_key(self, region):
+        return bisect_right(self.bounds, region[1]) * line_stride + region[0]
+
+    def point(self, x, y):
+        line = bisect_right(self.bounds, y)
+        found = bisect_right(self.keys, line * line_stride + x) - 1
+        if found < 0 or self.keys[found] // line_stride != line:
+            return None
+
+        region = self.regions[found]
+        return (region[4], region[5]) if x < region[2] else None
+
+    def points(self, x, y):
+        # the same search as point for arrays of points, returning the index
+        # into regions for every point or -1 where there is no ayah
+        x = np.asarray(x, dtype=float)
+        lines = np.searchsorted(self.bounds, np.asarray(y, dtype=float), "right")
+        found = np.searchsorted(self.key_array, lines * line_stride + x, "right") - 1
+        safe = np.maximum(found, 0)
+        hit = (found >= 0) & (self.key_array[safe] // line_stride == lines)
+        hit &= x < self.x1[safe]
+        return np.where(hit, found, -1)
+
+    def rectangle(self, x0, y0, x1, y1):
+        # ayahs with a region overlapping the rectangle, in reading order
+        found = set()
+        first = max(bisect_right(self.bounds, y0), 1)
+        last = min(bisect_right(self.bounds, y1), len(self.bounds) - 1)
+        for line in range(first, last + 1):
+            if self.bounds[line - 1] >= y1:
+                continue
+            start = bisect_left(self.keys, line * line_stride)
+            end = bisect_left(self.keys, line * line_stride + x1)
+            for region in self.regions[start:end]:
+                if region[2] > x0:
+                    found.add((region[6], region[4], region[5]))
+        return [x[1:] for x in sorted(found)]
+
+
+def load_regions(filepath=regions_file):
+    with open(filepath) as fp:
+        pages = json.load(fp)
+    return {int(x): RegionIndex(int(x), regions) for x, regions in pages.items()}
+
+
+def brute_force_point(regions, x, y):
+    for region in regions:
+        if region[0] <= x < region[2] and region[1] <= y < region[3]:
+            return (region[4], region[5])
+    return None
+
+
+def brute_force_rectangle(regions, x0, y0, x1, y1):
+    found = [x for x in regions if x[0] < x1 and x[2] > x0 and x[1] < y1 and x[3] > y0]
+    return [tuple(x[4:6]) for x in sorted(found, key=lambda x: x[6])]
+
+
+def validate_regions(indexes, samples=2000, seed=0):
+    # compares the index with a linear scan over random points and rectangles
+    # on every page, returning the page and query of every mismatch
+    random = np.random.RandomState(seed)
+    mismatches = []
+    for page_number, index in indexes.items():
+        width, height = page_size(page_number)
+        xs = random.uniform(-5, width + 5, samples)
+        ys = random.uniform(-5, height + 5, samples)
+        batch = index.points(xs, ys)
+        for x, y, found in zip(xs, ys, batch):
+            expected = brute_force_point(index.regions, x, y)
+            batched = None if found < 0 else tuple(index.regions[found][4:6])
+            if not expected == index.point(x, y) == batched:
+                mismatches.append((page_number, (x, y)))
+
+        for x, y in zip(xs[: samples // 10], ys[: samples // 10]):
+            rectangle = (x, y, x + random.uniform(0, 100), y + random.uniform(0, 100))
+            expected = list(
+                dict.fromkeys(brute_force_rectangle(index.regions, *rectangle))
+            )
+            if index.rectangle(*rectangle) != expected:
+                mismatches.append((page_number, rectangle))
+
+    return mismatches
+
+
+if __name__ == "__main__":
+    write_regions(build_regions())
+    if "--validate" in sys.argv:
+        mismatches = validate_regions(load_regions())
+        for page_number, query in mismatches[:20]:
+            print(f"  page {page_number:03} {query}")
+        print(f"{len(mismatches)} mismatches against a linear scan")
@@ -0,0 +1,240 @@
+import hashlib
+import json
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from os import path, stat
+from socketserver import ThreadingMixIn
+
+import compress
+
+output_dir = compress.output_dir
+cache_bytes = 64 * 1024 * 1024
+content_types = {".svg": "image/svg+xml", ".json": "application/json"}
+# a name with the hash of its content, as written to compressed.json
+hashed_url = re.compile(r"^(.+)\.([0-9a-f]{%d})(\.\w+)$" % compress.hash_length)
+byte_range = re.compile(r"^bytes=(\d*)-(\d*)$")
+immutable = "public, max-age=31536000, immutable"
+latency_samples = 10000
+
+
+class FileCache:
+    # the most recently used files with their ETags, bounded by total size, a
+    # stat per request notices files rewritten by a build
+
+    def __init__(self, directory=output_dir, max_bytes=cache_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        # returns (data, digest), raises FileNotFoundError for missing files
+        filepath = path.join(self.directory, name)
+        info = stat(filepath)
+        version = (info.st_mtime_ns, info.st_size)
+
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(name)
+                self.hits += 1
+                return entry[1], entry[2]
+
+        with open(filepath, "rb") as fp:
+            data = fp.read()
+        digest = hashlib.sha256(data).hexdigest()
+
+        with self.lock:
+            self.misses += 1
+            if name in self.entries:
+                self.size -= len(self.entries.pop(name)[1])
+            if len(data) <= self.max_bytes:
+                self.entries[name] = (version, data, digest)
+                self.size += len(data)
+            while self.size > self.max_bytes:
+                _, (_, evicted, _) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+        return data, digest
+
+
+class Counters:
+    def __init__(self):
+        self.statuses = {}
+        self.bytes_sent = 0
+        self.latencies = deque(maxlen=latency_samples)
+        self.lock = threading.Lock()
+
+    def record(self, status, bytes_sent, seconds):
+        with self.lock:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.bytes_sent += bytes_sent
+            self.latencies.append(seconds)
+
+    def snapshot(self, cache):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            statuses = dict(self.statuses)
+            bytes_sent = self.bytes_sent
+
+        def percentile(q):
+            if len(latencies) == 0:
+                return 0
+            return round(latencies[int(q * (len(latencies) - 1))] * 1000, 3)
+
+        lookups = cache.hits + cache.misses
+        return {
+            "requests": sum(statuses.values()),
+            "statuses": {str(x): statuses[x] for x in sorted(statuses)},
+            "bytes_sent": bytes_sent,
+            "cache": {
+                "hits": cache.hits,
+                "misses": cache.misses,
+                "hit_rate": round(cache.hits / lookups, 4) if lookups > 0 else 0,
+                "files": len(cache.entries),
+                "bytes": cache.size,
+            },
+            "latency_ms": {"p50": percentile(0.5), "p99": percentile(0.99)},
+        }
+
+
+def parse_range(value, size):
+    # (start, end) of a single byte range, None to ignore the header and
+    # False if it cannot be satisfied
+    found = byte_range.match(value.strip())
+    if found is None:
+        return None
+
+    first, last = found.groups()
+    if first == "" and last == "":
+        return None
+    if first == "":
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last != "" else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def serve_file(cache, request_path, headers):
+    # returns (status, response headers, body) for a GET of request_path
+    name = request_path.split("?")[0].lstrip("/")
+    expected_hash = None
+    hashed = hashed_url.match(name)
+    if hashed is not None:
+        name = hashed.group(1) + hashed.group(3)
+        expected_hash = hashed.group(2)
+
+    if not compress.served_file.match(name):
+        return 404, {}, b""
+    try:
+        data, digest = cache.get(name)
+    except FileNotFoundError:
+        return 404, {}, b""
+    if expected_hash is not None and not digest.startswith(expected_hash):
+        return 404, {}, b""
+
+    etag = f'"{digest[:16]}"'
+    response_headers = {
+        "Content-Type": content_types[path.splitext(name)[1]],
+        "ETag": etag,
+        "Cache-Control": immutable if expected_hash is not None else "no-cache",
+        "Accept-Ranges": "bytes",
+    }
+
+    if_none_match = headers.get("If-None-Match")
+    if if_none_match is not None:
+        tags = [x.strip() for x in if_none_match.split(",")]
+        if "*" in tags or etag in tags or f"W/{etag}" in tags:
+            return 304, response_headers, b""
+
+    requested = headers.get("Range")
+    if requested is not None and headers.get("If-Range", etag) == etag:
+        found = parse_range(requested, len(data))
+        if found is False:
+            response_headers["Content-Range"] = f"bytes */{len(data)}"
+            return 416, response_headers, b""
+        if found is not None:
+            start, end = found
+            response_headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+            return 206, response_headers, data[start : end + 1]
+
+    return 200, response_headers, data
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def respond(self, send_body):
+        start_time = time.perf_counter()
+        if self.path.split("?")[0] == "/stats":
+            body = json.dumps(self.server.stats(), indent=4).encode()
+            status, headers = 200, {"Content-Type": "application/json"}
+        else:
+            status, headers, body = serve_file(
+                self.server.cache, self.path, self.headers
+            )
+
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+        sent = len(body) if send_body else 0
+        self.server.counters.record(status, sent, time.perf_counter() - start_time)
+
+    def log_message(self, format, *args):
+        # every request is counted instead, see /stats
+        pass
+
+
+class PageServer(ThreadingMixIn, HTTPServer):
+    # serves the build output as it is laid out on disk, so 001.svg,
+    # 001/1.svg, 001.json and markers.json, plus hashed names from
+    # compressed.json and the counters at /stats
+    daemon_threads = True
+
+    def __init__(self, address, directory=output_dir, max_bytes=cache_bytes):
+        super().__init__(address, PageHandler)
+        self.cache = FileCache(directory, max_bytes)
+        self.counters = Counters()
+
+    def stats(self):
+        return self.counters.snapshot(self.cache)
+
+
+if __name__ == "__main__":
+    port = 8000
+    max_bytes = cache_bytes
+    for argument in sys.argv[1:]:
+        if argument.startswith("--port="):
+            port = int(argument.split("=")[1])
+        elif argument.startswith("--cache-mb="):
+            max_bytes = int(float(argument.split("=")[1]) * 1024 * 1024)
+
+    server = PageServer(("", port), output_dir, max_bytes)
+    print(f"Serving {output_dir} on port {server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1,8 +1,19 @@
+from os import path
+
 import optimize
 import positions
-import pytest
+import validate
 
 
 def test_all():
     optimize.optimize_svgs()
+    with open(path.join(optimize.output_dir, "markers.json")) as fp:
+        markers = fp.read()
+
+    # reading the markers back from the pages gives the same positions
     positions.generate_positions()
+    with open(path.join(optimize.output_dir, "markers.json")) as fp:
+        assert fp.read() == markers
+
+    # line files are checked by test_validate on a page of their own
+    assert validate.validate_output(check_lines=False) == []
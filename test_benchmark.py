@@ -0,0 +1,18 @@
+import benchmark
+
+
+def test_benchmark_compare():
+    baseline = {
+        "optimize": {
+            "003": {"seconds": 1.0, "stages": {"scour": 0.5}, "peak_rss_mb": 50.0}
+        }
+    }
+    result = {"seconds": 1.1, "stages": {"scour": 0.5}, "peak_rss_mb": 50.0}
+    assert benchmark.compare({"optimize": {"003": result}}, baseline) == []
+
+    result = {"seconds": 1.1, "stages": {"scour": 1.0}, "peak_rss_mb": 60.0}
+    regressions = benchmark.compare({"optimize": {"003": result}}, baseline)
+    assert [x.split(":")[0] for x in regressions] == [
+        "optimize 003 scour",
+        "optimize 003 memory",
+    ]
@@ -0,0 +1,16 @@
+import subprocess
+import sys
+from os import path
+
+
+def test_lazy_imports():
+    # the driver and the stage modules start without their heavy dependencies
+    script = (
+        "import sys, build, optimize, line_split; "
+        "print([x for x in ['numpy', 'scour.scour', 'svgelements', 'svgpathtools'] "
+        "if x in sys.modules])"
+    )
+    output = subprocess.check_output(
+        [sys.executable, "-c", script], cwd=path.dirname(path.realpath(__file__))
+    )
+    assert output.strip() == b"[]"
@@ -0,0 +1,41 @@
+import gzip
+import json
+
+import compress
+
+
+def test_compress(tmp_path):
+    (tmp_path / "001").mkdir()
+    (tmp_path / "001.svg").write_text(
+        "<svg>" + "<path d='M 0,0 L 1,1'/>" * 50 + "</svg>"
+    )
+    (tmp_path / "001.json").write_text(json.dumps([{"x": 1.5, "y": 2.5}] * 20))
+    (tmp_path / "markers.json").write_text(json.dumps({"1": [[1, 1, 1.5, 2.5]]}))
+    (tmp_path / "001" / "1.svg").write_text("<svg><path d='M 0,0 L 1,1'/></svg>")
+    (tmp_path / "001" / "15.svg").write_text("<svg><path d='M 2,2 L 3,3'/></svg>")
+    # files apps do not fetch are left alone
+    (tmp_path / "manifest.json").write_text("{}")
+
+    assert compress.compress_output(str(tmp_path)) == 5
+    manifest = json.loads((tmp_path / "compressed.json").read_text())
+    assert sorted(manifest) == [
+        "001.json",
+        "001.svg",
+        "001/1.svg",
+        "001/15.svg",
+        "markers.json",
+    ]
+    for name, entry in manifest.items():
+        data = (tmp_path / name).read_bytes()
+        compressed = (tmp_path / (name + ".gz")).read_bytes()
+        assert gzip.decompress(compressed) == data
+        assert entry["size"] == len(data) and entry["gzip"] == len(compressed)
+        assert entry["url"] == compress.hashed_name(name, entry["hash"])
+
+    # only the changed file is compressed again, and stale siblings go away
+    with open(tmp_path / "001.json", "a") as fp:
+        fp.write("\n")
+    (tmp_path / "001" / "15.svg").unlink()
+    assert compress.compress_output(str(tmp_path)) == 1
+    assert gzip.decompress((tmp_path / "001.json.gz").read_bytes()).endswith(b"\n")
+    assert not (tmp_path / "001" / "15.svg.gz").exists()
@@ -0,0 +1,24 @@
+import json
+import re
+
+import dedup
+import optimize
+import positions
+
+
+def test_dedup(tmp_path, monkeypatch):
+    monkeypatch.setattr(optimize, "output_dir", str(tmp_path))
+    monkeypatch.setattr(dedup, "glyphs_dir", str(tmp_path / "glyphs"))
+    with open(positions.surahs_file) as fp:
+        surahs = json.load(fp)
+    optimize.process_file("604.svg", surahs)
+
+    result = dedup.dedup_pages(self_contained=True)
+    assert result["symbols"] < result["shapes"]
+    assert result["deviation"] <= dedup.dedup_tolerance
+    assert result["bytes_out"] < result["bytes_in"]
+
+    page = (tmp_path / "glyphs" / "604.svg").read_text()
+    references = set(re.findall(r'xlink:href="#(s\d+)"', page))
+    assert len(references) == result["shared"]
+    assert references == set(re.findall(r'<symbol id="(s\d+)"', page))
@@ -0,0 +1,89 @@
+import json
+import shutil
+
+import compress
+import delta
+import pytest
+
+
+def write_build(directory, page_paths, x, header_position, line_fill):
+    # a small build tree with the files apps fetch, written like the build
+    # writes them
+    (directory / "001").mkdir(parents=True)
+    paths = "".join(f'<path d="{d}"/>' for d in page_paths)
+    (directory / "001.svg").write_text(f"<svg><g>{paths}</g></svg>")
+    (directory / "002.svg").write_text('<svg><g><path d="m5 5h2"/></g></svg>')
+    items = [{"ayah": 1, "surah": 1, "x": x, "y": 120.5}, {"ayah": 2, "x": 60.25}]
+    (directory / "001.json").write_text(json.dumps(items, indent=4, sort_keys=True))
+    surahs = [
+        {"name": "الفاتحة", "number": 1, "headerPosition": 40.5},
+        {"name": "البقرة", "number": 2, "headerPosition": header_position},
+    ]
+    (directory / "surah.json").write_text(
+        json.dumps(surahs, ensure_ascii=False, indent=4, sort_keys=True)
+    )
+    (directory / "001" / "1.svg").write_text(
+        f'<svg><g fill="{line_fill}"><path d="m1 1h3"/></g></svg>'
+    )
+
+
+def test_delta(tmp_path):
+    old_dir, new_dir, out_dir = tmp_path / "old", tmp_path / "new", tmp_path / "out"
+    page_paths = [f"m{x} 0h{x + 1}v2" for x in range(40)]
+    write_build(old_dir, page_paths, 30.5, 300.5, "#000000")
+    # one path of a page, a position, a surah header and a line file change
+    write_build(
+        new_dir, ["m0 0" + page_paths[0]] + page_paths[1:], 31.5, 302, "#111111"
+    )
+    (new_dir / "002.svg").unlink()
+    (new_dir / "001" / "ayahs.json").write_text("[]")
+
+    bundle = delta.make_delta(str(old_dir), str(new_dir))
+    kinds = {x["name"]: x["kind"] for x in delta.read_delta(bundle)}
+    assert kinds == {
+        "001.svg": "tokens",
+        "001.json": "json",
+        "surah.json": "json",
+        "001/1.svg": "tokens",
+        "001/ayahs.json": "add",
+        "002.svg": "delete",
+    }
+    page = (new_dir / "001.svg").read_bytes()
+    assert len(bundle) < len(page)
+
+    shutil.copytree(old_dir, out_dir)
+    assert len(delta.apply_delta(bundle, str(out_dir))) == 6
+    for name in compress.served_files(str(new_dir)):
+        assert (out_dir / name).read_bytes() == (new_dir / name).read_bytes()
+    assert compress.served_files(str(out_dir)) == compress.served_files(str(new_dir))
+
+    # a delta only applies to the build it was made from
+    with pytest.raises(Exception):
+        delta.apply_delta(bundle, str(out_dir))
+
+
+def test_patched_file_add(tmp_path):
+    entry = {"name": "001.json", "kind": "add", "hash": delta.file_hash(b"[]")}
+    assert delta.patched_file(dict(entry, data="[]"), str(tmp_path)) == b"[]"
+
+    # added data is checked like patched data, and never replaces a file
+    with pytest.raises(Exception):
+        delta.patched_file(dict(entry, data="[1]"), str(tmp_path))
+    (tmp_path / "001.json").write_text("[2]")
+    with pytest.raises(Exception):
+        delta.patched_file(dict(entry, data="[]"), str(tmp_path))
+
+
+def test_unchanged_files(tmp_path):
+    old_dir, new_dir = tmp_path / "old", tmp_path / "new"
+    for directory in [old_dir, new_dir]:
+        directory.mkdir()
+        (directory / "001.svg").write_text("<svg/>")
+        (directory / "002.svg").write_text("<svg/>")
+        compress.compress_output(str(directory))
+    names = ["001.svg", "002.svg"]
+    assert delta.unchanged_files(str(old_dir), str(new_dir), names) == set(names)
+
+    # a file edited after compressed.json was written is read again
+    (new_dir / "002.svg").write_text("<svg><g/></svg>")
+    assert delta.unchanged_files(str(old_dir), str(new_dir), names) == {"001.svg"}
@@ -0,0 +1,215 @@
+from math import floor
+
+import numpy as np
+import pytest
+import svgpathtools
+
+import line_split
+import regions
+
+
+def detect_line_number(glyph_bounds, page_offset, line_height):
+    # the original one glyph at a time rules classify_bounds has to match
+    top_y_pos = glyph_bounds[2] - page_offset
+    bottom_y_pos = glyph_bounds[3] - page_offset
+
+    top_line = min(floor(top_y_pos / line_height) + 1, 15)
+    bottom_line = min(floor(bottom_y_pos / line_height) + 1, 15)
+
+    buffer_height = line_height / line_split.determinate_ratio
+    top_line_mid = (top_line - 0.5) * line_height
+    bottom_line_mid = (bottom_line - 0.5) * line_height
+
+    top_line_bounds = (top_line_mid + buffer_height, top_line_mid - buffer_height)
+    bottom_line_bounds = (
+        bottom_line_mid + buffer_height,
+        bottom_line_mid - buffer_height,
+    )
+
+    # shortcut for line 1 if top of path is above determination point
+    if top_line == 1 and top_y_pos <= top_line_bounds[0]:
+        return top_line
+
+    # shortcut for line 15 if bottom of path is below determination point
+    if bottom_line == 15 and bottom_y_pos >= bottom_line_bounds[1]:
+        return bottom_line
+
+    # check if top or bottom of path is within top line determination bounds
+    if (
+        top_line_bounds[0] >= top_y_pos >= top_line_bounds[1]
+        or top_line_bounds[0] >= bottom_y_pos >= top_line_bounds[1]
+    ):
+        return top_line
+
+    # check if top or bottom of path is within bottom line determination bounds
+    if (
+        bottom_line_bounds[0] >= top_y_pos >= bottom_line_bounds[1]
+        or bottom_line_bounds[0] >= bottom_y_pos >= bottom_line_bounds[1]
+    ):
+        return bottom_line
+
+    # check if middle of path is within top line determination bounds
+    if top_y_pos <= top_line_bounds[0] and bottom_y_pos >= top_line_bounds[1]:
+        return top_line
+
+    # check if middle of path is within bottom line determination bounds
+    if top_y_pos <= bottom_line_bounds[0] and bottom_y_pos >= bottom_line_bounds[1]:
+        return bottom_line
+
+    return None
+
+
+def indeterminate_path_info(glyph_bounds, page_offset, line_height):
+    # the original candidate lines and midline distance of a glyph that
+    # detect_line_number could not place
+    top_y_pos = glyph_bounds[2] - page_offset
+    bottom_y_pos = glyph_bounds[3] - page_offset
+
+    top_line = min(floor(top_y_pos / line_height) + 1, 15)
+    bottom_line = min(floor(bottom_y_pos / line_height) + 1, 15)
+
+    if top_line == bottom_line:
+        if top_y_pos < ((top_line - 0.5) * line_height):
+            top_line = bottom_line - 1
+        else:
+            bottom_line = top_line + 1
+
+    top_distance = top_y_pos - ((top_line - 0.5) * line_height)
+    bottom_distance = ((bottom_line - 0.5) * line_height) - bottom_y_pos
+
+    return (top_line, bottom_line), min(top_distance, bottom_distance)
+
+
+def test_path_distance():
+    glyph = svgpathtools.parse_path("M 0,0 C 5,10 10,-10 15,0 L 15,5 Q 7,12 0,5 Z")
+    other = svgpathtools.parse_path("M 3,8 C 6,14 12,14 18,9 L 18,20 L 3,20 Z")
+
+    points = line_split.sample_path(other)
+    expected_points = [other.point(t) for t in line_split.sample_t_values()]
+    assert np.allclose(points, expected_points)
+
+    distances = line_split.path_distance(line_split.flatten_path(glyph), points)
+    expected = [glyph.radialrange(x)[0][0] for x in expected_points]
+    assert np.allclose(distances, expected, atol=1e-3)
+
+
+def test_line_index():
+    rng = np.random.default_rng(0)
+    glyphs = []
+    line = line_split.LineIndex()
+    for x, width in zip(rng.uniform(0, 345, 200), rng.uniform(0, 20, 200)):
+        glyph = svgpathtools.parse_path(f"M {x},0 L {x + width},5")
+        glyphs.append(line_split.Glyph(glyph))
+        line.add(glyphs[-1])
+
+    for x_min in range(-10, 345, 5):
+        x_max = x_min + 20
+        expected = [x for x in glyphs if x.bbox[0] <= x_max and x.bbox[1] >= x_min]
+        assert line.overlapping(x_min, x_max) == expected
+
+
+def test_classify_bounds():
+    # random glyphs over the whole page and beyond it, plus glyphs whose edges
+    # sit exactly on the midline buffers where the comparisons tip over
+    rng = np.random.default_rng(0)
+    page_offset, line_height = 12.5, 35.2
+    buffer_height = line_height / line_split.determinate_ratio
+    tops = list(rng.uniform(-20, 560, 3000))
+    heights = list(rng.uniform(0, 80, 3000))
+    for line in range(1, 16):
+        mid = (line - 0.5) * line_height
+        for edge in [mid - buffer_height, mid, mid + buffer_height]:
+            tops += [edge + page_offset, edge + page_offset - 10]
+            heights += [10, 10]
+
+    bounds = np.array([(0, 1, y, y + h) for y, h in zip(tops, heights)])
+    line_numbers, candidates, distances = line_split.classify_bounds(
+        bounds, page_offset, line_height
+    )
+    for i, glyph_bounds in enumerate(bounds.tolist()):
+        expected = detect_line_number(glyph_bounds, page_offset, line_height)
+        assert line_numbers[i] == (expected or 0)
+        if not expected:
+            lines, distance = indeterminate_path_info(
+                glyph_bounds, page_offset, line_height
+            )
+            assert tuple(candidates[i]) == lines
+            assert distances[i] == distance
+
+
+def test_segment_ayahs():
+    # line 3 holds the end of 2:5 from the right edge to its marker at x 100,
+    # then 2:6 to the left edge
+    bounds = regions.line_bounds(50)
+    region_index = regions.RegionIndex(
+        50,
+        [
+            [100, bounds[2], 345, bounds[3], 2, 5, 11],
+            [0, bounds[2], 100, bounds[3], 2, 6, 12],
+        ],
+    )
+    mid = (bounds[2] + bounds[3]) / 2
+    lines = {x: line_split.LineIndex() for x in range(1, 16)}
+    for x0, x1, y0, y1 in [
+        (200, 220, mid - 8, mid + 8),
+        (92, 108, mid - 8, mid + 8),
+        (93, 99, mid - 3, mid + 3),
+        (20, 40, mid - 10, mid + 6),
+    ]:
+        glyph = svgpathtools.parse_path(f"M {x0},{y0} L {x1},{y1}")
+        lines[3].add(line_split.Glyph(glyph))
+
+    # the digit inside the marker belongs to 2:5 even though its centre is not
+    ayahs = line_split.segment_ayahs(
+        50, lines, bounds[0], (bounds[-1] - bounds[0]) / 15, region_index, [(100, mid)]
+    )
+    assert ayahs == [
+        {
+            "surah": 2,
+            "ayah": 5,
+            "rects": [[92, round(mid - 8, 2), 220, round(mid + 8, 2)]],
+        },
+        {
+            "surah": 2,
+            "ayah": 6,
+            "rects": [[20, round(mid - 10, 2), 40, round(mid + 6, 2)]],
+        },
+    ]
+
+
+def test_parse_pages():
+    assert line_split.parse_pages("3") == [3]
+    assert line_split.parse_pages("602-604") == [602, 603, 604]
+    assert line_split.parse_pages("all") == list(range(1, 605))
+    for argument in ["0", "605", "5-4", "1-605", "x"]:
+        with pytest.raises(ValueError):
+            line_split.parse_pages(argument)
+
+
+def test_longest_first(tmp_path, monkeypatch):
+    # pages with more indeterminate paths last time go first, then larger ones
+    monkeypatch.setattr(line_split, "svg_dir", str(tmp_path))
+    for page, size in [(1, 10), (2, 30), (3, 20), (4, 40)]:
+        (tmp_path / f"{page:03}.svg").write_text("x" * size)
+    summary = {1: {"indeterminate": 5}, 3: {"indeterminate": 5}, 4: {"error": "x"}}
+    assert line_split.longest_first([1, 2, 3, 4], summary) == [3, 1, 4, 2]
+
+
+def test_split_glyphs():
+    # the same subpaths as splitting the path definition at every move
+    definition = (
+        "M 0,0 L 10,0 L 10,10 Z M 20,0 C 25,10 30,-10 35,0 Q 30,5 20,0 "
+        "M 40,0 A 5,5 0 0 1 50,0 L 40,0 M 60,0 L 70,5"
+    )
+    other = "M 80,0 L 90,0 L 85,5 Z M 100,0 L 110,10"
+    paths = [svgpathtools.parse_path(definition), svgpathtools.parse_path(other)]
+
+    glyphs = line_split.split_glyphs(paths)
+    expected = [
+        svgpathtools.parse_path(f"M{x}")
+        for _path in paths
+        for x in _path.d().split("M")
+        if len(x.strip()) > 0
+    ]
+    assert [x.path for x in glyphs] == expected
+    assert [x.bbox for x in glyphs] == [x.bbox() for x in expected]
@@ -0,0 +1,19 @@
+import minify
+import pytest
+
+
+def test_minify_path():
+    definition = (
+        "M 10.004,20 L 10.004,25.5 L 12.25,25.5 C 13,26 14,26 15,25.5 S 17,25 18,25.5 z"
+    )
+    minified, deviation = minify.minify_path(definition, 0.01)
+    assert minified == "m10 20v5.5h2.25c.75.5 1.75.5 2.75 0s2-.5 3 0z"
+    assert deviation == pytest.approx(0.004)
+
+    # a transform that doubles the path halves the grid step
+    minified, deviation = minify.minify_path(definition, 0.01, 2)
+    assert minified.startswith("m10.004 20")
+    assert deviation == 0
+
+    with pytest.raises(Exception):
+        minify.minify_path("M 0,0 A 5,5 0 0 1 10,0", 0.01)
@@ -0,0 +1,265 @@
+import json
+import shutil
+from multiprocessing import Pool
+from os import path
+from xml.dom import minidom
+
+import numpy as np
+import optimize
+import positions
+import pytest
+from svgelements import Path
+
+
+def test_optimize_cache(tmp_path, monkeypatch):
+    svg_dir = tmp_path / "svg"
+    output_dir = tmp_path / "output"
+    svg_dir.mkdir()
+    output_dir.mkdir()
+    for filename in ["003.svg", "604.svg"]:
+        shutil.copy(path.join(optimize.svg_dir, filename), svg_dir / filename)
+
+    monkeypatch.setattr(optimize, "svg_dir", str(svg_dir))
+    monkeypatch.setattr(optimize, "output_dir", str(output_dir))
+
+    optimize.optimize_svgs()
+    first_build = {x.name: x.stat().st_mtime_ns for x in output_dir.glob("*.svg")}
+    surahs = json.loads((output_dir / "surah.json").read_text())
+
+    with open(svg_dir / "003.svg", "a") as fp:
+        fp.write("\n")
+
+    optimize.optimize_svgs()
+    manifest = json.loads((output_dir / "manifest.json").read_text())
+
+    assert (output_dir / "003.svg").stat().st_mtime_ns != first_build["003.svg"]
+    assert (output_dir / "604.svg").stat().st_mtime_ns == first_build["604.svg"]
+    assert json.loads((output_dir / "surah.json").read_text()) == surahs
+    assert [x["number"] for x in manifest["604.svg"]["surahs"]] == [112, 113, 114]
+    # headers are counted on pages where no surah starts too
+    assert [manifest[x]["headers"] for x in ["003.svg", "604.svg"]] == [0, 3]
+    page_regions = json.loads((output_dir / "regions.json").read_text())
+    assert sorted(page_regions, key=int) == ["3", "604"]
+
+
+def test_optimize_failures(tmp_path, monkeypatch):
+    svg_dir = tmp_path / "svg"
+    output_dir = tmp_path / "output"
+    svg_dir.mkdir()
+    output_dir.mkdir()
+    for filename in ["003.svg", "604.svg"]:
+        shutil.copy(path.join(optimize.svg_dir, filename), svg_dir / filename)
+    (svg_dir / "004.svg").write_text("<svg")
+
+    source_dir = optimize.svg_dir
+    monkeypatch.setattr(optimize, "svg_dir", str(svg_dir))
+    monkeypatch.setattr(optimize, "output_dir", str(output_dir))
+
+    # the broken page is reported while the others are still built
+    failures = optimize.optimize_svgs()
+    manifest = json.loads((output_dir / "manifest.json").read_text())
+    assert list(failures) == ["004.svg"]
+    assert sorted(manifest) == ["003.svg", "604.svg"]
+    assert (output_dir / "surah.json").exists()
+    assert not (output_dir / "markers.json").exists()
+
+    first_build = (output_dir / "003.svg").stat().st_mtime_ns
+    shutil.copy(path.join(source_dir, "004.svg"), svg_dir / "004.svg")
+    assert optimize.optimize_svgs() == {}
+    assert (output_dir / "003.svg").stat().st_mtime_ns == first_build
+    assert (output_dir / "markers.json").exists()
+
+
+def test_chunks(tmp_path, monkeypatch):
+    for page, size in enumerate([50, 10, 20, 40, 10, 10, 60], 1):
+        (tmp_path / f"{page:03}.svg").write_text("x" * size)
+    monkeypatch.setattr(optimize, "svg_dir", str(tmp_path))
+    monkeypatch.setattr(optimize, "chunks_per_process", 2)
+
+    files = sorted(x.name for x in tmp_path.iterdir())
+    chunks = optimize.page_chunks(files, 2)
+    assert chunks == [
+        ["007.svg"],
+        ["001.svg"],
+        ["004.svg"],
+        ["003.svg", "002.svg", "005.svg", "006.svg"],
+    ]
+
+
+def test_pool_processes():
+    # chunks are sized for the processes the pool really has
+    with Pool(2) as p:
+        assert optimize.pool_processes(p) == 2
+
+
+def test_process_chunk_tolerance(tmp_path, monkeypatch):
+    # the tolerance is passed with the task, the module default is not used
+    monkeypatch.setattr(optimize, "output_dir", str(tmp_path))
+    monkeypatch.setattr(optimize, "worker_surahs", optimize.load_surahs())
+
+    [(_, full)] = optimize.process_chunk(["604.svg"], tolerance=None)
+    [(_, minified)] = optimize.process_chunk(["604.svg"], tolerance=0.05)
+    assert "minify" not in full["metrics"]["stages"]
+    counters = minified["metrics"]["counters"]
+    assert counters["bytes_out"] < full["metrics"]["counters"]["bytes_out"]
+    assert counters["max_deviation"] <= 0.05
+    assert optimize.code_version(None) != optimize.code_version(0.05)
+
+
+def test_parse_transform():
+    def affine(a, b, c, d, e, f):
+        return np.array([[a, c, e], [b, d, f], [0, 0, 1]])
+
+    angle = np.radians(30)
+    rotate = affine(np.cos(angle), np.sin(angle), -np.sin(angle), np.cos(angle), 0, 0)
+    expected = (
+        affine(1, 0, 0, 1, 10, 5)
+        @ affine(1, 0, 0, 1, 2, 3)
+        @ rotate
+        @ affine(1, 0, 0, 1, -2, -3)
+        @ affine(2, 0, 0, 0.5, 0, 0)
+        @ affine(1, 0, np.tan(np.radians(10)), 1, 0, 0)
+        @ affine(1, 0.2, 0.3, 1, 4, 5)
+    )
+
+    matrix = optimize.parse_transform(
+        "translate(10 5) rotate(30 2 3) scale(2 0.5) skewX(10) matrix(1 0.2 0.3 1 4 5)"
+    )
+    assert np.allclose(affine(*matrix), expected)
+
+
+def test_marker_positions(tmp_path, monkeypatch):
+    monkeypatch.setattr(optimize, "output_dir", str(tmp_path))
+    with open(positions.surahs_file) as fp:
+        surahs = json.load(fp)
+
+    # values produced by the previous Decimal based offset calculation
+    result = optimize.process_file("604.svg", surahs)
+    assert [x["headerPosition"] for x in result["surahs"]] == [24.01, 170.04, 351.34]
+    assert result["markers"] == [
+        (228.89, 100.41),
+        (130.37, 100.48),
+        (19.34, 100.46),
+        (91.36, 136.1),
+        (197.28, 244.09),
+        (81.29, 244.16),
+        (219.94, 280.17),
+        (19.33, 280.14),
+        (87.43, 314.6),
+        (178.52, 423.15),
+        (49.32, 423.11),
+        (267.88, 459.69),
+        (56.49, 459.64),
+        (70.95, 494.51),
+        (99.69, 531.2),
+    ]
+
+    page_metrics = result["metrics"]
+    assert page_metrics["page"] == 604
+    assert list(page_metrics["stages"]) == [
+        "parse",
+        "strip",
+        "headers",
+        "scour",
+        "markers",
+        "minify",
+        "write",
+    ]
+    assert page_metrics["counters"]["headers"] == 3
+    assert page_metrics["counters"]["markers"] == 15
+    assert (
+        page_metrics["counters"]["bytes_out"] < page_metrics["counters"]["bytes_full"]
+    )
+    assert page_metrics["counters"]["max_deviation"] <= optimize.minify_tolerance
+
+
+def test_estimate_path_size():
+    definition = "m 10,5 c 5,-10 20,10 30,0 h 200 v 25 L 12,31 l -2,-1 z m 1,1 2,2"
+    (outer_width, outer_height), (inner_width, inner_height) = (
+        optimize.estimate_path_size(definition)
+    )
+    xmin, ymin, xmax, ymax = Path(definition).bbox()
+
+    assert (inner_width, inner_height) == pytest.approx((230, 26))
+    assert inner_width <= xmax - xmin <= outer_width
+    assert inner_height <= ymax - ymin <= outer_height
+    assert optimize.estimate_path_size("M 0,0 A 5,5 0 0 1 10,0") is None
+
+
+escaped_page = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<svg xmlns="http://www.w3.org/2000/svg" id="a&amp;b" xmlns:x="urn:x">'
+    '<g clip-path="url(#c)"><g/><g/>'
+    '<g><g transform="translate(1 2)"><path d="M 0,0 L 1,1"/></g></g>'
+    '<g><path d="M 0,0 L 9,9" style="fill:#ffffff"/></g>'
+    '<g><g><path d="M 0,0 L 2,2"/></g>'
+    '<g x:title="x&#10;y&#9;&quot;&lt;&gt;" clip-path="url(#d)">'
+    "\n text &amp; &lt;more&gt;<!-- inner -->"
+    '<path d="M 0,0 L 3,3" style="fill:#ffffff"/><g></g>\n'
+    "</g></g></g></svg>"
+)
+
+
+def minidom_page(filepath, page_number, opening):
+    # the page as the minidom implementation serialized it before scour
+    doc = minidom.parse(filepath)
+    root_svg = doc.firstChild
+    width, height = (235, 235) if opening else (345, 550)
+    root_svg.setAttribute("width", f"{width}")
+    root_svg.setAttribute("height", f"{height}")
+    root_svg.setAttribute("viewBox", f"0 0 {width} {height}")
+
+    root_group = [x for x in root_svg.childNodes if x.nodeName == "g"][0]
+    root_children = root_group.childNodes
+    content_group = root_children[-1]
+    content_group.setAttribute("id", "content")
+    if opening:
+        root_group.setAttribute(
+            "transform", "matrix(1.3333333,0,0,-1.3333333,-136,482)"
+        )
+        root_children[-2].setAttribute("id", "ayah_markers")
+        removed = root_children[0:-2] + [content_group.firstChild.firstChild.lastChild]
+    else:
+        horizontal_offset = "-115" if page_number % 2 == 0 else "-55"
+        root_group.setAttribute(
+            "transform", f"matrix(1.3333333,0,0,-1.3333333,{horizontal_offset},640)"
+        )
+        root_children[2].setAttribute("id", "ayah_markers")
+        removed = (
+            root_children[0:2]
+            + root_children[3:-1]
+            + content_group.childNodes[0:-1]
+            + [
+                x
+                for x in root_group.getElementsByTagName("path")
+                if "fill:#ffffff" in x.getAttribute("style")
+            ]
+        )
+
+    for node in removed:
+        node.parentNode.removeChild(node)
+    root_svg.setAttribute("xmlns:ayah", "https://quranapp.com")
+    for node in doc.getElementsByTagName("*"):
+        if node.hasAttribute("clip-path"):
+            node.removeAttribute("clip-path")
+    return doc.toxml()
+
+
+@pytest.mark.parametrize("filename", ["001.svg", "002.svg", "187.svg", "604.svg", ""])
+def test_strip_page(tmp_path, filename):
+    # the streamed page matches the minidom serialization byte for byte on the
+    # opening pages and on surah starts, with and without a basmala, and on a
+    # page with the escaping, comments and text minidom writes
+    filepath = path.join(optimize.svg_dir, filename)
+    if filename == "":
+        filename = "003.svg"
+        filepath = str(tmp_path / filename)
+        with open(filepath, "w") as fp:
+            fp.write(escaped_page)
+    page_number = int(path.splitext(filename)[0])
+    opening = page_number < 3
+
+    out_string, _ = optimize.strip_page(
+        filepath, page_number, opening, optimize.count_children(filepath)
+    )
+    assert out_string == minidom_page(filepath, page_number, opening)
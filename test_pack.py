@@ -0,0 +1,40 @@
+import pack
+import pytest
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_pack(tmp_path, monkeypatch, compress):
+    monkeypatch.setattr(pack, "output_dir", str(tmp_path))
+    (tmp_path / "003").mkdir()
+    (tmp_path / "003.svg").write_bytes(b"<svg>page</svg>")
+    (tmp_path / "003" / "15.svg").write_bytes(b"<svg>line</svg>")
+    (tmp_path / "003.json").write_bytes(b"[]")
+    (tmp_path / "markers.json").write_bytes(b"[{}]")
+
+    pack.pack_output(str(tmp_path / "quran.pack"), compress)
+    with pack.PackReader(str(tmp_path / "quran.pack")) as reader:
+        assert bytes(reader.page(3)) == b"<svg>page</svg>"
+        assert bytes(reader.line(3, 15)) == b"<svg>line</svg>"
+        assert bytes(reader.positions(3)) == b"[]"
+        assert bytes(reader.corpus_file("markers.json")) == b"[{}]"
+        for page, line in [(4, 1), (3, 1), (3, 16), (0, 1), (605, 1)]:
+            with pytest.raises(KeyError):
+                reader.line(page, line)
+
+
+def test_pack_close(tmp_path, monkeypatch):
+    monkeypatch.setattr(pack, "output_dir", str(tmp_path))
+    (tmp_path / "003.svg").write_bytes(b"<svg>page</svg>")
+    pack.pack_output(str(tmp_path / "quran.pack"))
+
+    # a view still held keeps the mapping open, the file is closed regardless
+    reader = pack.PackReader(str(tmp_path / "quran.pack"))
+    view = reader.page(3)
+    with pytest.raises(BufferError):
+        reader.close()
+    assert reader.fp.closed
+    assert bytes(view) == b"<svg>page</svg>"
+
+    view.release()
+    reader.close()
+    assert reader.map.closed
@@ -0,0 +1,57 @@
+import json
+
+import numpy as np
+import positions
+import pytest
+
+
+def test_markers_binary(tmp_path):
+    with open(positions.surahs_file) as fp:
+        surahs = json.load(fp)
+    pages = [(1, [(171.69, 78.52), (49.3, 123.4)]), (2, []), (3, [(0.01, 549.99)])]
+
+    positions.write_positions(pages, surahs, str(tmp_path))
+    numbers, offsets, x, y = positions.read_markers_binary(
+        str(tmp_path / "markers.bin")
+    )
+    assert list(numbers) == [1, 2, 3] and list(offsets) == [0, 2, 2, 3]
+    assert x.dtype == np.float32 and list(np.round(y, 2)) == [78.52, 123.4, 549.99]
+
+    # the JSON files are regenerated byte for byte
+    (tmp_path / "regenerated").mkdir()
+    positions.positions_from_binary(
+        str(tmp_path / "markers.bin"), str(tmp_path / "regenerated")
+    )
+    for filename in ["markers.json", "001.json", "002.json", "003.json"]:
+        regenerated = (tmp_path / "regenerated" / filename).read_bytes()
+        assert regenerated == (tmp_path / filename).read_bytes()
+
+    # a partial build keeps its page numbers
+    (tmp_path / "partial").mkdir()
+    positions.write_positions(pages[2:], surahs, str(tmp_path / "partial"))
+    numbers, offsets, _, _ = positions.read_markers_binary(
+        str(tmp_path / "partial" / "markers.bin")
+    )
+    assert list(numbers) == [3] and list(offsets) == [0, 1]
+
+
+def test_read_markers(tmp_path):
+    # parsing stops at the end of the markers group, so the broken content
+    # after it is never read
+    page = (
+        '<svg xmlns="http://www.w3.org/2000/svg" '
+        'xmlns:ayah="https://quranapp.com/svg" viewBox="0 0 345 550">'
+        '<g><g id="ayah_markers">'
+        '<g ayah:x="200.5" ayah:y="80.25"><path d="M 0,0"/></g>'
+        '<g ayah:x="20" ayah:y="40.75"><g/></g>'
+        '</g><g id="content">' + "<path/>" * 20000 + "<broken"
+    )
+    (tmp_path / "003.svg").write_text(page)
+    assert positions.read_markers(str(tmp_path / "003.svg"), chunk_size=1024) == (
+        550,
+        [(200.5, 80.25), (20, 40.75)],
+    )
+
+    (tmp_path / "004.svg").write_text('<svg viewBox="0 0 345 550"><g/></svg>')
+    with pytest.raises(Exception):
+        positions.read_markers(str(tmp_path / "004.svg"))
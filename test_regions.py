@@ -0,0 +1,60 @@
+import shutil
+
+import numpy as np
+import positions
+import regions
+
+# the markers of page 604 in reading order, as optimize finds them
+page_604 = [
+    (228.89, 100.41),
+    (130.37, 100.48),
+    (19.34, 100.46),
+    (91.36, 136.1),
+    (197.28, 244.09),
+    (81.29, 244.16),
+    (219.94, 280.17),
+    (19.33, 280.14),
+    (87.43, 314.6),
+    (178.52, 423.15),
+    (49.32, 423.11),
+    (267.88, 459.69),
+    (56.49, 459.64),
+    (70.95, 494.51),
+    (99.69, 531.2),
+]
+
+
+def page_markers(page_number, count):
+    # count markers spread over the lines of a page in reading order
+    bounds = regions.line_bounds(page_number)
+    width, _ = regions.page_size(page_number)
+    lines = [i * (len(bounds) - 1) // count + 1 for i in range(count)]
+    markers = []
+    for i, line in enumerate(lines):
+        column = lines[:i].count(line)
+        y = (bounds[line - 1] + bounds[line]) / 2
+        markers.append((round(width - 20 - column * 40, 2), round(y, 2)))
+    return markers
+
+
+def test_regions(tmp_path):
+    # the pages before the last get synthetic markers for the ayahs before
+    # al-Ikhlas, so the ayahs of page 604 are numbered as in the build
+    surahs_file = tmp_path / "surah.json"
+    shutil.copy(positions.surahs_file, surahs_file)
+    counts = np.diff(np.linspace(0, 6236 - len(page_604), 604).astype(int))
+    pages = [(x, page_markers(x, int(y))) for x, y in enumerate(counts, 1)]
+    pages.append((604, page_604))
+    positions.write_markers_binary(pages, str(tmp_path / "markers.bin"))
+
+    pages = regions.build_regions(str(tmp_path))
+    assert len(pages) == 604
+
+    # page 604 starts with the header and basmala of al-Ikhlas
+    index = regions.RegionIndex(604, pages[604])
+    assert index.point(300, 50) is None
+    assert index.point(300, 100) == (112, 1)
+    assert index.rectangle(0, 80, 345, 110) == [(112, 1), (112, 2), (112, 3), (112, 4)]
+
+    indexes = {x: regions.RegionIndex(x, pages[x]) for x in [1, 2, 50, 200, 604]}
+    assert regions.validate_regions(indexes, samples=500) == []
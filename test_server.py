@@ -0,0 +1,65 @@
+import hashlib
+import http.client
+import threading
+import time
+
+import server
+
+
+def test_serve_file(tmp_path):
+    (tmp_path / "001").mkdir()
+    (tmp_path / "001.svg").write_bytes(b"0123456789")
+    (tmp_path / "001" / "1.svg").write_bytes(b"x" * 8)
+    (tmp_path / "manifest.json").write_text("{}")
+    cache = server.FileCache(str(tmp_path), max_bytes=12)
+
+    status, headers, body = server.serve_file(cache, "/001.svg", {})
+    assert (status, body, headers["Cache-Control"]) == (200, b"0123456789", "no-cache")
+    etag = headers["ETag"]
+    assert server.serve_file(cache, "/001.svg", {"If-None-Match": etag})[0] == 304
+
+    ranges = {"bytes=2-4": b"234", "bytes=7-": b"789", "bytes=-2": b"89"}
+    for value, expected in ranges.items():
+        status, headers, body = server.serve_file(cache, "/001.svg", {"Range": value})
+        assert (status, body) == (206, expected)
+    assert server.serve_file(cache, "/001.svg", {"Range": "bytes=10-"})[0] == 416
+    stale_range = {"Range": "bytes=2-4", "If-Range": '"old"'}
+    assert server.serve_file(cache, "/001.svg", stale_range)[0] == 200
+
+    digest = hashlib.sha256(b"0123456789").hexdigest()
+    status, headers, _ = server.serve_file(cache, f"/001.{digest[:12]}.svg", {})
+    assert (status, headers["Cache-Control"]) == (200, server.immutable)
+    for request_path in ["/001.000000000000.svg", "/manifest.json", "/../x.svg"]:
+        assert server.serve_file(cache, request_path, {})[0] == 404
+
+    # the line file pushes the page out of the 12 byte cache
+    assert server.serve_file(cache, "/001/1.svg", {})[0] == 200
+    assert list(cache.entries) == ["001/1.svg"]
+    assert (cache.hits, cache.misses) == (8, 2)
+
+
+def test_page_server(tmp_path):
+    (tmp_path / "001.json").write_text("[]")
+    page_server = server.PageServer(("127.0.0.1", 0), str(tmp_path))
+    threading.Thread(target=page_server.serve_forever, daemon=True).start()
+    try:
+        connection = http.client.HTTPConnection(*page_server.server_address)
+        for request_path, status in [("/001.json", 200), ("/002.json", 404)]:
+            connection.request("GET", request_path)
+            response = connection.getresponse()
+            assert (response.status, response.read()) == (
+                status,
+                b"[]" if status == 200 else b"",
+            )
+
+        # requests are counted once the response is written, so just after the
+        # client has read it
+        deadline = time.time() + 5
+        while page_server.stats()["requests"] < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        stats = page_server.stats()
+        assert stats["statuses"] == {"200": 1, "404": 1}
+        assert stats["cache"]["misses"] == 1
+    finally:
+        page_server.shutdown()
+        page_server.server_close()
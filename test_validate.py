@@ -0,0 +1,37 @@
+import json
+import shutil
+
+import positions
+import validate
+
+
+def test_validate(tmp_path):
+    # page 604 as the build writes it, with four ayah markers
+    markers = "".join(f'<g ayah:x="{x}" ayah:y="100"><path/></g>' for x in range(4))
+    (tmp_path / "604.svg").write_text(
+        '<svg xmlns="http://www.w3.org/2000/svg" '
+        'xmlns:ayah="https://quranapp.com/svg" viewBox="0 0 345 550"><g>'
+        f'<g id="ayah_markers">{markers}</g><g id="content"><path/></g></g></svg>'
+    )
+    (tmp_path / "604.json").write_text(json.dumps([{"x": 1, "y": 100}] * 3))
+    (tmp_path / "markers.json").write_text(json.dumps([[604, 1, 1, 100]] * 6236))
+    manifest = {"604.svg": {"surahs": [], "headers": 2, "markers": []}}
+    (tmp_path / "manifest.json").write_text(json.dumps(manifest))
+    shutil.copy(positions.surahs_file, tmp_path / "surah.json")
+    surahs = json.loads((tmp_path / "surah.json").read_text())
+    surahs[112]["headerPosition"] = 600
+    (tmp_path / "surah.json").write_text(json.dumps(surahs))
+    (tmp_path / "604").mkdir()
+    for line in range(1, 14):
+        (tmp_path / "604" / f"{line}.svg").write_text("<svg/>")
+
+    violations = validate.validate_output(str(tmp_path))
+    assert [x for x in violations if x[0] == 604] == [
+        (604, "4 markers in the page, 3 in 604.json"),
+        (604, "3 surahs start on the page in surah.json, 2 headers were found"),
+        (604, "surah 113 header position 600 is off the page"),
+        (604, "line files missing: 14, 15"),
+    ]
+    assert (603, "603.svg is missing") in violations
+    assert (None, "4 ayah markers, expected 6236") in violations
+    assert (None, "markers.json has 6236 markers") in violations
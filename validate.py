@@ -0,0 +1,178 @@
+import json
+import sys
+import time
+from functools import partial
+from multiprocessing import Pool
+from os import path
+from xml.etree.ElementTree import ParseError, XMLPullParser
+
+import positions
+
+output_dir = positions.output_dir
+page_count = 604
+ayah_count = 6236
+line_count = 15
+required_groups = ["ayah_markers", "content"]
+
+
+def scan_page(filepath, chunk_size=65536):
+    # returns (page height, marker count, group ids found), parsing only until
+    # the markers group has closed and the content group has opened
+    parser = XMLPullParser(events=("start", "end"))
+    page_height = None
+    markers = 0
+    groups = set()
+    depth = 0
+    markers_depth = None
+    markers_closed = False
+
+    with open(filepath, "rb") as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b""):
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                if event == "end":
+                    depth -= 1
+                    if depth == markers_depth:
+                        markers_closed = True
+                    continue
+
+                if page_height is None:
+                    page_height = float(element.get("viewBox").split()[3])
+                if markers_depth is not None and not markers_closed:
+                    if depth == markers_depth + 1:
+                        markers += 1
+                group_id = element.get("id")
+                if group_id in required_groups:
+                    groups.add(group_id)
+                    if group_id == "ayah_markers":
+                        markers_depth = depth
+                depth += 1
+
+                if markers_closed and "content" in groups:
+                    return page_height, markers, groups
+
+    parser.close()
+    return page_height, markers, groups
+
+
+def check_page(page, page_surahs, built, directory, check_lines):
+    # returns (page, marker count, violations) for one page of the output,
+    # built being its manifest entry
+    violations = []
+    filename = f"{page:03}.svg"
+    filepath = path.join(directory, filename)
+    if not path.exists(filepath):
+        return page, 0, [f"{filename} is missing"]
+
+    try:
+        page_height, markers, groups = scan_page(filepath)
+    except (ParseError, AttributeError, ValueError) as e:
+        return page, 0, [f"{filename} cannot be read: {e}"]
+
+    for group in required_groups:
+        if group not in groups:
+            violations.append(f"no {group} group")
+
+    positions_file = path.join(directory, f"{page:03}.json")
+    if not path.exists(positions_file):
+        violations.append(f"{page:03}.json is missing")
+    else:
+        with open(positions_file) as fp:
+            items = json.load(fp)
+        if len(items) != markers:
+            violations.append(
+                f"{markers} markers in the page, {len(items)} in {page:03}.json"
+            )
+
+    # the build records how many headers it found on each page in the
+    # manifest, except on the opening pages whose header positions are fixed
+    if built is None:
+        violations.append("not in manifest.json")
+    elif built.get("headers") is not None:
+        if built["headers"] != len(page_surahs):
+            violations.append(
+                f"{len(page_surahs)} surahs start on the page in surah.json, "
+                f"{built['headers']} headers were found"
+            )
+    for surah in page_surahs:
+        position = surah.get("headerPosition")
+        if position is None or not 0 < position < (page_height or 0):
+            violations.append(
+                f"surah {surah['number']} header position {position} is off the page"
+            )
+
+    if check_lines:
+        missing = [
+            str(x)
+            for x in range(1, line_count + 1)
+            if not path.exists(path.join(directory, f"{page:03}", f"{x}.svg"))
+        ]
+        if len(missing) > 0:
+            violations.append(f"line files missing: {', '.join(missing)}")
+
+    return page, markers, violations
+
+
+def load_json(filepath, default):
+    if not path.exists(filepath):
+        return default
+    with open(filepath) as fp:
+        return json.load(fp)
+
+
+def validate_output(directory=output_dir, check_lines=True, pool=None):
+    # returns (page, message) for every violation, page None for the corpus
+    surahs = load_json(path.join(directory, "surah.json"), None)
+    manifest = load_json(path.join(directory, "manifest.json"), {})
+    violations = []
+    if surahs is None:
+        violations.append((None, "surah.json is missing"))
+        surahs = []
+
+    page_surahs = {}
+    for surah in surahs:
+        page_surahs.setdefault(surah["pageNumber"], []).append(surah)
+    pages = list(range(1, page_count + 1))
+    task = partial(check_page, directory=directory, check_lines=check_lines)
+    items = [(x, page_surahs.get(x, []), manifest.get(f"{x:03}.svg")) for x in pages]
+
+    def run(p):
+        return list(p.starmap(task, items, 16))
+
+    if pool is None:
+        with Pool() as p:
+            results = run(p)
+    else:
+        results = run(pool)
+
+    total = 0
+    for page, markers, messages in results:
+        total += markers
+        violations.extend((page, x) for x in messages)
+
+    if total != ayah_count:
+        violations.append((None, f"{total} ayah markers, expected {ayah_count}"))
+    surah_ayahs = sum(x["ayahCount"] for x in surahs)
+    if surah_ayahs != ayah_count:
+        violations.append((None, f"surah.json has {surah_ayahs} ayahs"))
+    markers = load_json(path.join(directory, "markers.json"), None)
+    if markers is None:
+        violations.append((None, "markers.json is missing"))
+    elif len(markers) != total:
+        violations.append((None, f"markers.json has {len(markers)} markers"))
+
+    return violations
+
+
+def print_violations(violations):
+    for page, message in violations:
+        print(f"  {'corpus' if page is None else f'page {page:03}'}: {message}")
+
+
+if __name__ == "__main__":
+    start_time = time.time()
+    violations = validate_output(check_lines="--skip-lines" not in sys.argv)
+    print_violations(violations)
+    print(f"{len(violations)} violations in {time.time() - start_time:.2f} seconds")
+    if len(violations) > 0:
+        sys.exit(1)